@@ -1,10 +1,18 @@
 from .grid_node import BattlemapGrid
 from .map_node import BattlemapMapGenerator, BattlemapMapGeneratorOutdoors
 from .compass_node import CompassGrid
+from .overlay_node import BattlemapOverlay
+from .scene_node import BattlemapSceneRenderer
+from .batch_node import (BattlemapMapGeneratorBatch,
+                         BattlemapMapGeneratorOutdoorsBatch)
 
 NODE_CLASS_MAPPINGS = {
     "Map Generator": BattlemapMapGenerator,
     "Map Generator(Outdoors)": BattlemapMapGeneratorOutdoors,
+    "Map Generator(Batch)": BattlemapMapGeneratorBatch,
+    "Map Generator(Outdoors, Batch)": BattlemapMapGeneratorOutdoorsBatch,
+    "Scene Renderer": BattlemapSceneRenderer,
     "Compass": CompassGrid,
     "Battlemap Grid": BattlemapGrid,
+    "Battlemap Overlay": BattlemapOverlay,
 }
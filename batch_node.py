@@ -0,0 +1,269 @@
+import atexit
+import json
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from pathlib import Path
+import torch
+from . import profiling
+from .map_node import BattlemapMapGenerator, BattlemapMapGeneratorOutdoors
+from .scene import scaled_length
+from .utils import empty_image, tensor_to_uint8
+
+
+def parse_seeds(seeds: str) -> list[int]:
+    """
+    Parse a comma separated list of seeds and inclusive ranges, such as
+    "1, 5, 10-20".
+    """
+    result = list()
+    for item in seeds.replace("\n", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition("-")
+        if last:
+            result.extend(range(int(first), int(last) + 1))
+        else:
+            result.append(int(first))
+    return result
+
+
+def generate_frame(node_class: type, inputs: dict, scene: bool = False,
+                   render_threads: int = 0) -> tuple:
+    """
+    Run the single seed node and return its image as uint8, a quarter of
+    the float size to transfer, followed by its other outputs by name but
+    the stats, and but the scene unless asked for. render_threads is given
+    in the worker processes only.
+    """
+    if render_threads:
+        BattlemapMapGenerator._render_threads = render_threads
+        # every worker renders other seeds
+        BattlemapMapGenerator.layer_cache.max_bytes = 0
+    start = time.perf_counter()
+    result = node_class().map_generator(**inputs)
+    outputs = dict(zip(node_class.RETURN_NAMES[1:-1], result[1:-1]))
+    if not scene:
+        del outputs["scene"]
+    return (tensor_to_uint8(result[0][0]), outputs,
+            time.perf_counter() - start)
+
+
+def serve_frames(output_fd: int):
+    """
+    Main loop of the worker processes: generate the frames whose pickled
+    generate_frame arguments arrive on stdin, and write each, or the
+    traceback of its failure, to output_fd, until stdin is closed.
+    """
+    output = os.fdopen(output_fd, "wb")
+    while True:
+        try:
+            args = pickle.load(sys.stdin.buffer)
+        except EOFError:
+            return
+        try:
+            reply = (False, generate_frame(*args))
+        except Exception:
+            reply = (True, traceback.format_exc())
+        pickle.dump(reply, output)
+        output.flush()
+
+
+class FrameWorker:
+    """
+    Worker process, a plain interpreter running serve_frames. Unlike the
+    children of multiprocessing, it does not run the main module of the
+    host again, which for ComfyUI would boot a server of its own: it only
+    imports the package, from its parent directory. What it prints goes to
+    stderr, its stdout carrying the frames.
+    """
+
+    def __init__(self):
+        parent = Path(__file__).resolve().parents[__package__.count(".") + 1]
+        self.process = subprocess.Popen(
+            [sys.executable, "-c",
+             "import importlib, os, sys; output = os.dup(1); os.dup2(2, 1); "
+             f"sys.path.insert(0, {str(parent)!r}); "
+             f"importlib.import_module({__name__!r}).serve_frames(output)"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def generate(self, *args) -> tuple:
+        pickle.dump(args, self.process.stdin)
+        self.process.stdin.flush()
+        try:
+            failed, result = pickle.load(self.process.stdout)
+        except EOFError:
+            raise RuntimeError(f"Batch worker exited with status "
+                               f"{self.process.wait()}") from None
+        if failed:
+            raise RuntimeError(f"Batch worker failed:\n{result}")
+        return result
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class WorkerPool:
+    """
+    Worker processes, started on first use and kept across runs, each
+    driven by one thread handing it a frame at a time.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._executor = ThreadPoolExecutor(size)
+        self._workers = queue.SimpleQueue()
+        for _ in range(size):
+            self._workers.put(None)
+
+    def submit(self, *args) -> Future:
+        return self._executor.submit(self._generate, *args)
+
+    def _generate(self, *args) -> tuple:
+        worker = self._workers.get() or FrameWorker()
+        try:
+            return worker.generate(*args)
+        finally:
+            # a worker that died is replaced on next use
+            self._workers.put(worker if worker.process.poll() is None
+                              else None)
+
+    def close(self):
+        self._executor.shutdown()
+        while not self._workers.empty():
+            worker = self._workers.get()
+            if worker is not None:
+                worker.close()
+
+
+class BatchMixin:
+    """
+    Generate one map per seed, in process or on a pool of worker processes,
+    with exactly the images of the single seed node. Finished frames are
+    copied into the preallocated output as they arrive, at most two per
+    worker waiting.
+    """
+    _max_workers = 64
+    # shared by the batch nodes, replaced only for another number of workers
+    _pool = None
+
+    @classmethod
+    def INPUT_TYPES(cls) -> dict:
+        inputs = super().INPUT_TYPES()
+        inputs["required"]["count"] = (
+            "INT", {"default": 4, "min": 1, "max": 4096})
+        inputs["optional"].update({
+            "seeds": ("STRING", {"default": "", "multiline": True}),
+            # 0 starts a worker per CPU
+            "workers": ("INT", {"default": 1, "min": 0,
+                                "max": cls._max_workers}),
+        })
+        return inputs
+
+    @classmethod
+    @property
+    def RETURN_TYPES(cls) -> tuple:
+        return super().RETURN_TYPES + ("STRING",)
+
+    @classmethod
+    @property
+    def RETURN_NAMES(cls) -> tuple:
+        return super().RETURN_NAMES + ("metadata",)
+
+    FUNCTION = "batch_generator"
+
+    @property
+    def single_node(self) -> type:
+        return next(base for base in type(self).__mro__
+                    if base is not type(self)
+                    and not issubclass(base, BatchMixin))
+
+    @staticmethod
+    def pool(workers: int) -> WorkerPool:
+        pool = BatchMixin._pool
+        if pool is None or pool.size != workers:
+            if pool is not None:
+                pool.close()
+            pool = BatchMixin._pool = WorkerPool(workers)
+        return pool
+
+    def batch_generator(self, seed: int, count: int, seeds: str = "",
+                        workers: int = 1, memmap: bool = False,
+                        instrumentation: bool = False, **inputs) -> tuple:
+        seed_list = parse_seeds(seeds) or list(range(seed, seed + count))
+        if not workers:
+            # the workers only start as frames are handed to them
+            workers = os.cpu_count() or 1
+        node = self.single_node
+        names = node.RETURN_NAMES[1:-1]
+        with profiling.profile(type(self).__name__,
+                               instrumentation) as profiler:
+            scale = inputs.get("preview_scale", 1.0)
+            images = empty_image(
+                len(seed_list),
+                scaled_length(inputs["grid_height"] * inputs["grid_side"],
+                              scale),
+                scaled_length(inputs["grid_width"] * inputs["grid_side"],
+                              scale), memmap)
+            metadata = [None] * len(seed_list)
+
+            def store(index: int, frame: tuple):
+                image, outputs, elapsed = frame
+                with profiling.stage("batch/store"):
+                    images[index].copy_(torch.from_numpy(image)).div_(255.0)
+                metadata[index] = {"seed": seed_list[index], "time": elapsed,
+                                   **outputs}
+                profiling.count("frames")
+
+            if workers <= 1:
+                for index, item_seed in enumerate(seed_list):
+                    store(index, generate_frame(node, {
+                        **inputs, "seed": item_seed}, index == 0))
+            else:
+                pool = self.pool(workers)
+                render_threads = max(1, (os.cpu_count() or 1) // workers)
+                pending = dict()
+                for index, item_seed in enumerate(seed_list):
+                    if len(pending) >= 2 * workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            store(pending.pop(future), future.result())
+                    frame = {**inputs, "seed": item_seed}
+                    pending[pool.submit(node, frame, index == 0,
+                                        render_threads)] = index
+                for future in wait(pending).done:
+                    store(pending[future], future.result())
+        # only the scene of the first map is kept, out of the metadata
+        first = metadata[0]
+        scene = first.pop("scene")
+        return (images, *(scene if name == "scene" else first[name]
+                          for name in names),
+                profiler.to_json() if profiler else "",
+                json.dumps(metadata))
+
+
+class BattlemapMapGeneratorBatch(BatchMixin, BattlemapMapGenerator):
+    pass
+
+
+class BattlemapMapGeneratorOutdoorsBatch(BatchMixin,
+                                         BattlemapMapGeneratorOutdoors):
+    pass
+
+
+@atexit.register
+def close_pool():
+    if BatchMixin._pool is not None:
+        BatchMixin._pool.close()
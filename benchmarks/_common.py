@@ -0,0 +1,14 @@
+import importlib
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_package():
+    """
+    Import the node package the same way ComfyUI does, from its parent
+    directory, so that the relative imports resolve.
+    """
+    sys.path.insert(0, str(ROOT.parent))
+    return importlib.import_module(ROOT.name)
@@ -0,0 +1,48 @@
+import argparse
+import random
+import time
+
+import numpy as np
+from PIL import Image
+
+from _common import load_package
+
+package = load_package()
+utils = package.utils
+Point = package.point.Point
+
+
+def bench(func, size: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        image = Image.new("RGBA", (size, size), "#00FF00")
+        random.seed(0)
+        start = time.perf_counter()
+        func(image)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the per-pixel and vectorized noise engines")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[128, 256, 512, 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'legacy (s)':>12} {'numpy (s)':>12} {'speedup':>9}")
+    for size in args.sizes:
+        box = (Point(0, 0), Point(size, size))
+        legacy = bench(lambda im: utils.generate_noise_legacy(im, *box),
+                       size, args.repeat)
+        vectorized = bench(
+            lambda im: utils.generate_noise(
+                im, *box, rng=np.random.default_rng(0)),
+            size, args.repeat)
+        print(f"{size:>6} {legacy:>12.4f} {vectorized:>12.4f} "
+              f"{legacy / vectorized:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Benchmark suite for the nodes, across a matrix of map sizes.
+
+Every case runs in its own interpreter so that its peak RSS is not
+polluted by the previous ones, and with the caches of the nodes emptied
+before every run, so that the timings are those of cold renders. Typical
+use:
+
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json
+
+The second command exits with status 1 when a case is slower than the
+baseline by more than --threshold.
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from _common import load_package
+
+FONT = str(Path(__file__).resolve().parent / "fonts" / "DejaVuSans.ttf")
+SIZES = ["10x10@32", "32x32@32", "64x64@64", "128x128@64"]
+FEATURES = ("river", "road", "rocks", "trees")
+SEED = 42
+
+
+def parse_size(size: str) -> tuple[int, int, int]:
+    grid, side = size.split("@")
+    width, height = grid.split("x")
+    return int(width), int(height), int(side)
+
+
+def list_cases(sizes: list) -> list[dict]:
+    cases = list()
+    for size in sizes:
+        cases.append({"node": "map", "size": size})
+        for toggle in ("none",) + FEATURES + ("all",):
+            cases.append({"node": "outdoors", "size": size,
+                          "features": toggle})
+        for grid_type in ("square", "vertical hexagon",
+                          "horizontal hexagon"):
+            cases.append({"node": "grid", "size": size,
+                          "grid_type": grid_type})
+        cases.append({"node": "compass", "size": size})
+        cases.append({"node": "overlay", "size": size})
+    return cases
+
+
+def case_name(case: dict) -> str:
+    options = [str(value) for key, value in case.items()
+               if key not in ("node", "size")]
+    return "/".join([case["node"], case["size"]] + options)
+
+
+def build_case(case: dict):
+    """
+    Return a function running the case once, with all inputs prepared.
+    """
+    import torch
+
+    package = load_package()
+    width, height, side = parse_size(case["size"])
+    if case["node"] == "map":
+        node = package.BattlemapMapGenerator()
+        return lambda: node.map_generator(SEED, width, height, side,
+                                          "#00FF00")
+    if case["node"] == "outdoors":
+        node = package.BattlemapMapGeneratorOutdoors()
+        toggles = {feature: case["features"] in (feature, "all")
+                   for feature in FEATURES}
+        return lambda: node.map_generator(SEED, width, height, side,
+                                          "#00FF00", **toggles)
+
+    generator = torch.Generator().manual_seed(SEED)
+    image = torch.rand((1, height * side, width * side, 3),
+                       generator=generator)
+    if case["node"] == "grid":
+        node = package.BattlemapGrid()
+        return lambda: node.grid_overlay(image, case["grid_type"], side, 1,
+                                         255, 255, 255, 255)
+    if case["node"] == "compass":
+        node = package.CompassGrid()
+        return lambda: node.compass_overlay(image, FONT, "NWSE",
+                                            "bottom right", 64, SEED, 0,
+                                            True)
+    if case["node"] == "overlay":
+        node = package.BattlemapOverlay()
+        return lambda: node.overlay(image, FONT, "NWSE", "bottom right", 64,
+                                    SEED, 0, True, grid_type="square",
+                                    grid_side=side, line_width=1, red=255,
+                                    green=255, blue=255, alpha=255)
+    raise ValueError(f"Unknown node: {case['node']}")
+
+
+def clear_caches():
+    """
+    Empty the caches of the nodes and disable the disk cache, so that every
+    run renders from scratch instead of timing cache hits.
+    """
+    package = load_package()
+    package.grid_node.BattlemapGrid.overlay_cache.clear()
+    package.compass_node.CompassGrid.sprite_cache.clear()
+    package.scene.sprite_cache.clear()
+    package.map_node.BattlemapMapGenerator.layer_cache.clear()
+    package.disk_cache.disk_cache.directory = None
+
+
+def run_case(case: dict, repeat: int) -> dict:
+    run = build_case(case)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = list()
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    clear_caches()
+    tracemalloc.start()
+    run()
+    snapshot = tracemalloc.take_snapshot()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss_unit = 1 if platform.system() == "Darwin" else 1024
+    return {
+        "name": case_name(case),
+        "case": case,
+        "first": times[0],
+        "best": min(times),
+        "times": times,
+        "peak_rss": rss_peak * rss_unit,
+        "rss_increase": (rss_peak - rss_before) * rss_unit,
+        "traced_peak": traced_peak,
+        # blocks allocated during the run and still alive after it
+        "live_blocks": sum(stat.count
+                           for stat in snapshot.statistics("filename")),
+    }
+
+
+def run_isolated(case: dict, repeat: int, timeout: float) -> dict:
+    command = [sys.executable, __file__, "--case", json.dumps(case),
+               "--repeat", str(repeat)]
+    try:
+        process = subprocess.run(command, capture_output=True, text=True,
+                                 timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"name": case_name(case), "case": case,
+                "error": f"timeout after {timeout}s"}
+    if process.returncode:
+        # a case killed by a signal, such as the OOM killer's, says nothing
+        lines = process.stderr.strip().splitlines()
+        return {"name": case_name(case), "case": case,
+                "error": lines[-1] if lines
+                else f"exit status {process.returncode}"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    reference = {result["name"]: result
+                 for result in baseline["results"] if "error" not in result}
+    regressions = list()
+    for result in results:
+        if "error" in result or result["name"] not in reference:
+            continue
+        ratio = result["best"] / reference[result["name"]]["best"]
+        result["ratio"] = ratio
+        if ratio > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def print_result(result: dict):
+    if "error" in result:
+        print(f"{result['name']:<48} ERROR {result['error']}")
+        return
+    ratio = f"{result['ratio']:>6.2f}x" if "ratio" in result else ""
+    print(f"{result['name']:<48} {result['best']:>9.3f}s "
+          f"{result['first']:>9.3f}s {result['peak_rss'] / 2 ** 20:>9.0f}MB "
+          f"{result['traced_peak'] / 2 ** 20:>9.1f}MB "
+          f"{result['live_blocks']:>9} {ratio}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=SIZES,
+                        help="map sizes as WIDTHxHEIGHT@SIDE")
+    parser.add_argument("--filter", default="",
+                        help="only run the cases whose name contains it")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline file to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="fail when best time > baseline * threshold")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case), args.repeat)))
+        return
+
+    baseline = json.loads(Path(args.compare).read_text()) \
+        if args.compare else None
+    print(f"{'case':<48} {'best':>10} {'first':>10} {'peak rss':>11} "
+          f"{'traced':>11} {'blocks':>9}")
+    results = list()
+    for case in list_cases(args.sizes):
+        if args.filter not in case_name(case):
+            continue
+        result = run_isolated(case, args.repeat, args.timeout)
+        if baseline:
+            compare([result], baseline, args.threshold)
+        print_result(result)
+        results.append(result)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "results": results,
+        }, indent=2))
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for result in regressions:
+            print(f"REGRESSION {result['name']}: {result['ratio']:.2f}x "
+                  f"slower than the baseline")
+        if regressions:
+            sys.exit(1)
+    if any("error" in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def env_megabytes(name: str, default: int) -> int:
+    return int(float(os.environ.get(name, default)) * 2 ** 20)
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the total size in bytes of its
+    values rather than by their number.
+    """
+
+    def __init__(self, max_bytes: int, sizeof=lambda value: value.nbytes):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value: int):
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    def _evict(self):
+        while self._entries and self.nbytes > self._max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if size > self._max_bytes:
+                return value
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries), "bytes": self.nbytes,
+                "max_bytes": self._max_bytes}
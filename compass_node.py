@@ -1,12 +1,23 @@
 import torch
+import math
+from functools import lru_cache
 from PIL.ImageDraw import Draw
-from PIL import ImageFont
-from .utils import tensor_to_pil, pil_to_tensor
+from PIL import Image, ImageFont
+from .cache import LRUCache, env_megabytes
+from .utils import patch_images
 from .point import Point
 import random
 
 
+@lru_cache(maxsize=32)
+def load_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font, size)
+
+
 class CompassGrid:
+    sprite_cache = LRUCache(env_megabytes("BATTLEMAP_COMPASS_CACHE_MB", 64),
+                            sizeof=lambda sprite: sprite[0].width
+                            * sprite[0].height * 4)
 
     def __init__(self):
         self.black_pen = (0, 0, 0)
@@ -39,21 +50,21 @@ class CompassGrid:
     FUNCTION = "compass_overlay"
     CATEGORY = "Battlemaps"
 
-    def get_center_position(self, image_pil, position: str,
+    def get_center_position(self, width: int, height: int, position: str,
                             size: int) -> Point:
         point = Point(0, 0)
         padding = int(size / 2)
         if "top" in position:
             point.y = size + padding
         elif "bottom" in position:
-            point.y = image_pil.height - size - padding
+            point.y = height - size - padding
         else:
             raise ValueError("Cannot position the compass")
 
         if "left" in position:
             point.x = size + padding
         elif "right" in position:
-            point.x = image_pil.width - size - padding
+            point.x = width - size - padding
         else:
             raise ValueError("Cannot position the compass")
 
@@ -81,15 +92,49 @@ class CompassGrid:
     def compass_overlay(self, image: torch.Tensor, font: str, cardinals: str,
                         position: str, size: int,
                         seed: int,
-                        rotation: int, random_rotation: bool):
-        image_pil = tensor_to_pil(image)
-        draw = Draw(image_pil, "RGBA")
+                        rotation: int, random_rotation: bool,
+                        inplace: bool = False):
         if random_rotation:
             random.seed(seed)
             rotation = random.randint(0, 360)
+        sprite, corner = self.get_sprite(font, cardinals, size, rotation)
+        height, width = image.shape[1:3]
+        corner = self.get_center_position(width, height, position,
+                                          size) + corner
+
+        def paste_compass(patch, origin: Point):
+            patch.paste(sprite, (corner - origin).coord(), sprite)
+            return patch
 
-        font = ImageFont.truetype(font, int(size / 4))
-        center = self.get_center_position(image_pil, position, size)
+        return (patch_images(image, (corner.x, corner.y,
+                                     corner.x + sprite.width,
+                                     corner.y + sprite.height),
+                             paste_compass, inplace),)
+
+    def get_sprite(self, font: str, cardinals: str, size: int,
+                   rotation: int) -> tuple[Image.Image, Point]:
+        """
+        The compass drawn on a transparent image, and the position of its
+        top left corner relative to the compass center.
+        """
+        key = (font, cardinals, size, rotation)
+        sprite = self.sprite_cache.get(key)
+        if sprite is None:
+            radius = math.ceil(size * 1.6)
+            image_pil = Image.new("RGBA", (2 * radius, 2 * radius),
+                                  (0, 0, 0, 0))
+            self.draw_compass(image_pil, load_font(font, int(size / 4)),
+                              cardinals, Point(radius, radius), size,
+                              rotation)
+            bbox = image_pil.getbbox() or (0, 0, 1, 1)
+            sprite = self.sprite_cache.put(key, (
+                image_pil.crop(bbox), Point(bbox[0] - radius,
+                                            bbox[1] - radius)))
+        return sprite
+
+    def draw_compass(self, image_pil, font, cardinals: str, center: Point,
+                     size: int, rotation: int):
+        draw = Draw(image_pil, "RGBA")
         draw.ellipse(
             [(center - size * 0.8).coord(), (center + size * 0.8).coord()],
             outline=self.black_pen, width=min(6, round(size / 12)))
@@ -101,5 +146,3 @@ class CompassGrid:
         for i, card in zip(range(0, 360, 90), cardinals):
             self.draw_arrow(draw, font, center, i + rotation, size,
                             cardinal=card)
-        image_tensor_out = pil_to_tensor(image_pil)
-        return (image_tensor_out,)
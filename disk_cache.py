@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import torch
+from PIL import Image, PngImagePlugin
+from .cache import env_megabytes
+from .utils import tensor_to_uint8
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    Content addressed cache of generated images, stored as lossless PNG
+    files with their other outputs in a text chunk. Files are written to a
+    temporary name then renamed, so that several processes can share the
+    directory, and the least recently used ones (by modification time) are
+    removed once the directory is larger than max_bytes. The cache is
+    disabled when directory is None.
+    """
+    _metadata_key = "battlemap"
+
+    def __init__(self, directory: str = None, max_bytes: int = 0,
+                 compress_level: int = 1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    def key(self, *params) -> str:
+        return hashlib.sha256(json.dumps(params).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key: str):
+        """
+        Return the (image, outputs) stored under key, or None.
+        """
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            with Image.open(path) as image:
+                image.load()
+            outputs = json.loads(image.text[self._metadata_key])
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, SyntaxError) as error:
+            logger.warning("Discarding unreadable cache entry %s: %s",
+                           path, error)
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return image, outputs
+
+    def put(self, key: str, image_tensor: torch.Tensor, outputs: list):
+        """
+        Store a (H, W, 3) IMAGE and its JSON serializable outputs.
+        """
+        if not self.enabled:
+            return
+        array = tensor_to_uint8(image_tensor)
+        info = PngImagePlugin.PngInfo()
+        info.add_text(self._metadata_key, json.dumps(outputs))
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp",
+                                         delete=False) as file:
+            try:
+                Image.fromarray(array, "RGB").save(
+                    file, "PNG", pnginfo=info,
+                    compress_level=self.compress_level)
+            except BaseException:
+                file.close()
+                self._remove(file.name)
+                raise
+        os.replace(file.name, self.path(key))
+        with self._lock:
+            self.writes += 1
+        self.evict()
+
+    def evict(self):
+        entries = list()
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith(".png"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                with self._lock:
+                    self.evictions += 1
+            total -= size
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except OSError:
+            # already evicted by another process, or still open on Windows
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "writes": self.writes, "evictions": self.evictions,
+                "directory": self.directory, "max_bytes": self.max_bytes}
+
+
+disk_cache = DiskCache(os.environ.get("BATTLEMAP_DISK_CACHE_DIR"),
+                       env_megabytes("BATTLEMAP_DISK_CACHE_MB", 2048))
@@ -1,11 +1,72 @@
 import torch
+import numpy as np
+from PIL import Image
 from aggdraw import Draw, Brush, Pen
 import math
-from .utils import tensor_to_pil, pil_to_tensor
+from .cache import LRUCache, env_megabytes
 from .point import Point
 from dataclasses import dataclass
 
 
+# Position of the six vertices of an hexagon relative to its starting
+# point, for an edge length of 1. Each hexagon of a tiling owns the
+# polyline through its vertices 4, 5, 0 and 1, the three other edges being
+# owned by its neighbours.
+HEXAGON_OFFSETS = np.cumsum(
+    [(math.cos(math.radians(angle)), math.sin(math.radians(angle)))
+     for angle in range(0, 360, 60)], axis=0)
+HEXAGON_OWNED_EDGES = HEXAGON_OFFSETS[[4, 5, 0, 1]]
+# Unit normals of the edges of those hexagons, whose top and bottom edges
+# are horizontal.
+HEXAGON_NORMALS = ((0, 1), (math.sin(math.pi / 3), 0.5),
+                   (math.sin(math.pi / 3), -0.5))
+
+
+def square_distance(xs: torch.Tensor, ys: torch.Tensor,
+                    side: float) -> torch.Tensor:
+    """
+    Distance to the closest line of a square grid with lines through the
+    origin, for pixel coordinates xs (1, W) and ys (H, 1).
+    """
+    xs = xs - torch.round(xs / side) * side
+    ys = ys - torch.round(ys / side) * side
+    return torch.minimum(xs.abs(), ys.abs())
+
+
+def hexagon_distance(xs: torch.Tensor, ys: torch.Tensor,
+                     edge_length: float) -> torch.Tensor:
+    """
+    Distance to the closest edge of the tiling of HorizontalHexagonGenerator
+    centered on the origin. The hexagon centers form two rectangular
+    lattices, shifted by half a period: the closest center is the closest of
+    their two closest centers, and the point is inside its hexagon, at the
+    apothem minus its largest projection on the edge normals from the edges.
+    """
+    col_width = 3 * edge_length
+    row_height = 2 * math.sin(math.pi / 3) * edge_length
+    distance2 = None
+    for origin_x, origin_y in ((col_width / 2, row_height / 2),
+                               (col_width, row_height)):
+        dx = xs - origin_x
+        dx -= torch.round(dx / col_width) * col_width
+        dy = ys - origin_y
+        dy -= torch.round(dy / row_height) * row_height
+        lattice_distance2 = dx * dx + dy * dy
+        if distance2 is None:
+            distance2, closest_x, closest_y = lattice_distance2, dx, dy
+        else:
+            nearer = lattice_distance2 < distance2
+            closest_x = torch.where(nearer, dx, closest_x)
+            closest_y = torch.where(nearer, dy, closest_y)
+    nx, ny = HEXAGON_NORMALS[1]
+    closest_x *= nx
+    closest_y *= ny
+    projection = torch.maximum((closest_x + closest_y).abs_(),
+                               (closest_x - closest_y).abs_())
+    projection = torch.maximum(projection, closest_y.abs_().div_(ny))
+    return row_height / 2 - projection
+
+
 @dataclass
 class BaseHexagonGenerator(object):
     """
@@ -16,6 +77,7 @@ class BaseHexagonGenerator(object):
 
     edge_length: int = 0
     center: Point = None
+    transposed = False
 
     @property
     def col_width(self):
@@ -25,33 +87,66 @@ class BaseHexagonGenerator(object):
     def row_height(self):
         return math.sin(math.pi / 3) * self.edge_length
 
+    def start(self, row, col) -> tuple:
+        x = self.col_width / 3 + (col + 0.5 * (row % 2)) * self.col_width
+        y = row * self.row_height
+        if self.transposed:
+            return self.center.x + y, self.center.y + x
+        return self.center.x + x, self.center.y + y
 
-class HorizontalHexagonGenerator(BaseHexagonGenerator):
     def __call__(self, row, col):
-        x = self.center.x + self.col_width / 3 + (
-                col + 0.5 * (row % 2)) * self.col_width
-        y = self.center.y + row * self.row_height
-        for angle in range(0, 360, 60):
-            x += math.cos(math.radians(angle)) * self.edge_length
-            y += math.sin(math.radians(angle)) * self.edge_length
-            yield x
-            yield y
+        x, y = self.start(row, col)
+        offsets = HEXAGON_OFFSETS[:, ::-1] if self.transposed \
+            else HEXAGON_OFFSETS
+        for dx, dy in (offsets * self.edge_length).tolist():
+            yield x + dx
+            yield y + dy
+
+    def edges(self, left: float, top: float, right: float, bottom: float,
+              margin: float = 0) -> np.ndarray:
+        """
+        Polylines (N, 4, 2) of the edges owned by every hexagon crossing
+        the box, so that each edge of the tiling is listed once.
+        """
+        center_x, center_y = self.center.x, self.center.y
+        if self.transposed:
+            left, top, right, bottom = top, left, bottom, right
+            center_x, center_y = center_y, center_x
+        left, top = left - margin, top - margin
+        right, bottom = right + margin, bottom + margin
+        rows = np.arange(
+            math.floor((top - center_y) / self.row_height) - 1,
+            math.floor((bottom - center_y) / self.row_height) + 1)
+        cols = np.arange(
+            math.floor((left - center_x) / self.col_width) - 2,
+            math.ceil((right - center_x) / self.col_width) + 1)
+        starts = np.empty((len(rows), len(cols), 2))
+        starts[..., 0] = center_x + self.col_width / 3 + (
+                cols[None, :] + 0.5 * (rows[:, None] % 2)) * self.col_width
+        starts[..., 1] = center_y + rows[:, None] * self.row_height
+        polylines = (starts.reshape(-1, 1, 2)
+                     + HEXAGON_OWNED_EDGES * self.edge_length)
+        low, high = polylines.min(axis=1), polylines.max(axis=1)
+        visible = ((high[:, 0] >= left) & (low[:, 0] <= right)
+                   & (high[:, 1] >= top) & (low[:, 1] <= bottom))
+        polylines = polylines[visible]
+        if self.transposed:
+            return polylines[..., ::-1]
+        return polylines
+
+
+class HorizontalHexagonGenerator(BaseHexagonGenerator):
+    pass
 
 
 class VerticalHexagonGenerator(BaseHexagonGenerator):
-    def __call__(self, row, col):
-        x = self.center.x + row * self.row_height
-        y = self.center.y + self.col_width / 3 + (
-                col + 0.5 * (row % 2)) * self.col_width
-        for angle in range(0, 360, 60):
-            x += math.sin(math.radians(angle)) * self.edge_length
-            y += math.cos(math.radians(angle)) * self.edge_length
-            yield x
-            yield y
+    transposed = True
 
 
 class BattlemapGrid:
     _grid_type = ["square", "vertical hexagon", "horizontal hexagon"]
+    _engines = ["aggdraw", "sdf"]
+    overlay_cache = LRUCache(env_megabytes("BATTLEMAP_GRID_CACHE_MB", 512))
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -73,6 +168,10 @@ class BattlemapGrid:
                 "orig_grid_height": ("INT",
                                      {"default": None, "min": 00, "max": 128,
                                       "forceInput": True}),
+                "engine": (cls._engines, {"default": "aggdraw"}),
+                # 0 composites the whole image at once
+                "band_height": ("INT", {"default": 0, "min": 0,
+                                        "max": 8192, "step": 64}),
 
             }
         }
@@ -83,50 +182,240 @@ class BattlemapGrid:
     CATEGORY = "Battlemaps"
 
     def square_grid(self, image, draw, center,
-                    pen, grid_side):
-        for i in range(0, max(center.x, center.y), grid_side):
+                    pen, grid_side, line_width=1, extent=None):
+        # extent is the half size of the whole grid when image is a band
+        if extent is None:
+            extent = max(center.x, center.y)
+        for i in range(0, extent, grid_side):
             draw.line((center.x - i, 0, center.x - i, image.height), pen)
             draw.line((center.x + i, 0, center.x + i, image.height), pen)
-            draw.line((0, center.y - i, image.width, center.y - i), pen)
-            draw.line((0, center.y + i, image.width, center.y + i), pen)
+            for y in (center.y - i, center.y + i):
+                if -line_width <= y <= image.height + line_width:
+                    draw.line((0, y, image.width, y), pen)
 
     def hexagon_grid(self, hexagon_generator: BaseHexagonGenerator,
-                     image, draw, center, pen, grid_side):
+                     image, draw, center, pen, grid_side, line_width=1,
+                     top=0):
+        # the edges are placed in the whole image then moved to the band,
+        # whole pixels away, so that bands round them as the whole image
         hexagon_generator = hexagon_generator(grid_side, center)
-        nb_row = math.ceil(
-            (image.height / hexagon_generator.row_height) / 2) + 2
-        nb_col = math.ceil((image.width / hexagon_generator.col_width) / 2) + 2
-        for row in range(-nb_row, nb_row):
-            for col in range(-nb_col, nb_col):
-                hexagon = hexagon_generator(row, col)
-                draw.polygon(list(hexagon), pen)
+        edges = hexagon_generator.edges(0, top, image.width,
+                                        top + image.height,
+                                        margin=line_width)
+        edges[..., 1] -= top
+        for polyline in edges.reshape(-1, 8).tolist():
+            draw.line(polyline, pen)
 
     def grid_overlay(self, image: torch.Tensor,
                      grid_type: str, grid_side: int, line_width: int,
                      red: int, green: int, blue: int, alpha: int,
-                     orig_grid_width=None, orig_grid_height=None):
-        image_pil = tensor_to_pil(image)
-        # Create Grid
+                     orig_grid_width=None, orig_grid_height=None,
+                     engine: str = "aggdraw", band_height: int = 0):
+        height, width = image.shape[1:3]
+        grid_side = self.get_grid_side(width, height, grid_side,
+                                       orig_grid_width, orig_grid_height,
+                                       exact=engine == "sdf")
+        color = (red, green, blue, alpha)
+        if band_height:
+            return (self.composite_bands(image, grid_type, grid_side,
+                                         line_width, color, engine,
+                                         band_height),)
+        overlay = self.get_overlay(width, height, grid_type, grid_side,
+                                   line_width, color, engine)
+        return (self.composite(image, overlay, color),)
 
-        draw = Draw(image_pil)
-        pen = Pen((red, green, blue, alpha), line_width)
-        center = Point(int(image_pil.width / 2), int(image_pil.height / 2))
+    def get_grid_side(self, width: int, height: int, grid_side: int,
+                      orig_grid_width=None, orig_grid_height=None,
+                      exact: bool = False) -> float:
+        """
+        Side of the cells, from the original grid size when the image was
+        rescaled. It is only rounded to whole pixels when not exact.
+        """
         if (orig_grid_width and orig_grid_height):
-            width_rate = (image_pil.width / orig_grid_width)
-            height_rate = (image_pil.height / orig_grid_height)
+            width_rate = (width / orig_grid_width)
+            height_rate = (height / orig_grid_height)
             if 0.99 <= (width_rate / height_rate) <= 1.01:
-                grid_side = round(image_pil.width / orig_grid_width)
+                grid_side = width / orig_grid_width
+                if not exact:
+                    grid_side = round(grid_side)
+        return grid_side
+
+    def get_overlay(self, width: int, height: int, grid_type: str,
+                    grid_side: float, line_width: int, color: tuple,
+                    engine: str = "aggdraw") -> torch.Tensor:
+        key = (engine, grid_type, grid_side, line_width, color, width,
+               height)
+        overlay = self.overlay_cache.get(key)
+        if overlay is None:
+            if engine == "sdf":
+                overlay = self.rasterize_grid_sdf(
+                    width, height, grid_type, grid_side, line_width, color)
+            elif engine == "aggdraw":
+                overlay = self.rasterize_grid(
+                    width, height, grid_type, grid_side, line_width, color)
+            else:
+                raise ValueError(f"Unknown grid engine: {engine}")
+            overlay = self.overlay_cache.put(key, overlay)
+        return overlay
+
+    def grid_alpha(self, width: int, height: int, top: int, bottom: int,
+                   grid_type: str, grid_side: float, line_width: int,
+                   alpha: int, engine: str = "aggdraw") -> torch.Tensor:
+        """
+        Alpha channel of the grid over the rows top to bottom of a width x
+        height image, drawn from the lines crossing these rows only.
+        """
+        if engine == "sdf":
+            return self.grid_alpha_sdf(width, height, top, bottom, grid_type,
+                                       grid_side, line_width, alpha)
+        elif engine == "aggdraw":
+            # aggdraw antialiases the lines it clips and the points above
+            # its image differently, so bands are drawn with a margin inside
+            # the image that every polyline crossing them fits in, then
+            # cropped; they match the whole image up to the rounding of the
+            # float32 coordinates of aggdraw, a level or two of coverage
+            above, below = self.band_margins(width, height, top, bottom,
+                                             grid_type, grid_side,
+                                             line_width)
+            coverage = Image.new("L", (width, bottom - top + above + below))
+            self.draw_grid(coverage, grid_type, grid_side, line_width,
+                           (255, 255, 255, 255), (width, height), top - above)
+            coverage = np.asarray(coverage, dtype=np.uint16)[
+                above:above + bottom - top]
+            return torch.from_numpy(
+                ((coverage * alpha + 127) // 255).astype(np.uint8))
+        raise ValueError(f"Unknown grid engine: {engine}")
+
+    def band_margins(self, width: int, height: int, top: int, bottom: int,
+                     grid_type: str, grid_side: float,
+                     line_width: int) -> tuple[int, int]:
+        """
+        Rows above and below the rows top to bottom, within the image, that
+        the polylines crossing them span. None for square grids, whose lines
+        are all horizontal or vertical.
+        """
+        if grid_type == "square":
+            return 0, 0
+        generator = {"vertical hexagon": VerticalHexagonGenerator,
+                     "horizontal hexagon": HorizontalHexagonGenerator,
+                     }[grid_type](grid_side,
+                                  Point(int(width / 2), int(height / 2)))
+        ys = generator.edges(0, top, width, bottom, margin=line_width)[..., 1]
+        if not ys.size:
+            return 0, 0
+        # with room for the antialiasing of the pen around the points
+        pad = line_width + 2
+        above = max(0, math.ceil(top - ys.min()) + pad)
+        below = max(0, math.ceil(ys.max() - bottom) + pad)
+        return min(above, top), min(below, height - bottom)
+
+    def rasterize_grid(self, width: int, height: int, grid_type: str,
+                       grid_side: int, line_width: int,
+                       color: tuple) -> torch.Tensor:
+        """
+        Draw the grid once as a coverage mask and turn it into an RGBA
+        layer that can be composited on any image of the same size.
+        """
+        overlay = torch.empty((height, width, 4), dtype=torch.uint8)
+        overlay[..., :3] = torch.tensor(color[:3], dtype=torch.uint8)
+        overlay[..., 3] = self.grid_alpha(width, height, 0, height,
+                                          grid_type, grid_side, line_width,
+                                          color[3])
+        return overlay
+
+    def rasterize_grid_sdf(self, width: int, height: int, grid_type: str,
+                           grid_side: float, line_width: int, color: tuple,
+                           band_height: int = 256) -> torch.Tensor:
+        """
+        Same RGBA layer as rasterize_grid, computed by bands of rows.
+        """
+        overlay = torch.empty((height, width, 4), dtype=torch.uint8)
+        overlay[..., :3] = torch.tensor(color[:3], dtype=torch.uint8)
+        for top in range(0, height, band_height):
+            bottom = min(top + band_height, height)
+            overlay[top:bottom, :, 3] = self.grid_alpha_sdf(
+                width, height, top, bottom, grid_type, grid_side,
+                line_width, color[3])
+        return overlay
+
+    def grid_alpha_sdf(self, width: int, height: int, top: int, bottom: int,
+                       grid_type: str, grid_side: float, line_width: int,
+                       alpha: int) -> torch.Tensor:
+        """
+        grid_alpha from the distance of every pixel center to the closest
+        line. The coverage of a pixel by a line of width w at a distance d
+        is w / 2 + 1 / 2 - d, clamped to [0, 1], exact for straight lines
+        along the pixel grid. Cells do not need a whole number of pixels.
+        """
+        center_x, center_y = int(width / 2), int(height / 2)
+        xs = torch.arange(width, dtype=torch.float32)[None, :] \
+            + 0.5 - center_x
+        ys = torch.arange(top, bottom, dtype=torch.float32)[:, None] \
+            + 0.5 - center_y
+        if grid_type == "square":
+            distance = square_distance(xs, ys, grid_side)
+        elif grid_type == "vertical hexagon":
+            distance = hexagon_distance(ys, xs, grid_side)
+        elif grid_type == "horizontal hexagon":
+            distance = hexagon_distance(xs, ys, grid_side)
+        else:
+            raise ValueError(f"Unknown grid type: {grid_type}")
+        coverage = (line_width / 2 + 0.5 - distance).clamp_(0, 1)
+        return coverage.mul_(alpha).round_().to(torch.uint8)
+
+    def composite_bands(self, image: torch.Tensor, grid_type: str,
+                        grid_side: float, line_width: int, color: tuple,
+                        engine: str = "aggdraw",
+                        band_height: int = 256) -> torch.Tensor:
+        """
+        Same result as composite with the overlay of the grid, drawn and
+        blended band by band into the output, so that the extra memory
+        does not depend on the image height.
+        """
+        height, width = image.shape[1:3]
+        result = torch.empty(image.shape[:3] + (3,), dtype=image.dtype)
+        color_value = torch.tensor(color[:3], dtype=torch.float32) / 255.0
+        for top in range(0, height, band_height):
+            bottom = min(top + band_height, height)
+            weight = self.grid_alpha(
+                width, height, top, bottom, grid_type, grid_side,
+                line_width, color[3], engine)[..., None].to(
+                torch.float32).div_(255.0)
+            torch.lerp(image[:, top:bottom, :, :3], color_value, weight,
+                       out=result[:, top:bottom])
+        return result
+
+    @staticmethod
+    def composite(image: torch.Tensor, overlay: torch.Tensor,
+                  color: tuple) -> torch.Tensor:
+        weight = overlay[..., 3:].to(torch.float32).div_(255.0)
+        color = torch.tensor(color[:3], dtype=torch.float32) / 255.0
+        return torch.lerp(image[..., :3], color, weight)
+
+    def draw_grid(self, image_pil, grid_type: str, grid_side: int,
+                  line_width: int, color: tuple, size: tuple = None,
+                  top: int = 0):
+        """
+        Draw the grid of an image of the given size, the size of image_pil
+        by default, on image_pil as a band of its rows from top.
+        """
+        draw = Draw(image_pil)
+        pen = Pen(color, line_width)
+        width, height = size or image_pil.size
+        center = Point(int(width / 2), int(height / 2))
         if grid_type == "square":
-            self.square_grid(image_pil, draw, center, pen,
-                             grid_side)
+            self.square_grid(image_pil, draw,
+                             Point(center.x, center.y - top), pen,
+                             grid_side, line_width,
+                             max(center.x, center.y))
         elif grid_type == "vertical hexagon":
             self.hexagon_grid(VerticalHexagonGenerator,
-                              image_pil, draw, center, pen, grid_side)
+                              image_pil, draw, center, pen, grid_side,
+                              line_width, top)
         elif grid_type == "horizontal hexagon":
             self.hexagon_grid(HorizontalHexagonGenerator,
-                              image_pil, draw, center, pen, grid_side)
+                              image_pil, draw, center, pen, grid_side,
+                              line_width, top)
         else:
             raise Exception
         draw.flush()
-        image_tensor_out = pil_to_tensor(image_pil)
-        return (image_tensor_out,)
@@ -1,16 +1,49 @@
 from PIL import Image, ImageDraw, ImageColor, ImageFilter
 import math
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
 from dataclasses import dataclass
-from colorsys import rgb_to_hsv, hsv_to_rgb
-from random import random, randint, choice
+from itertools import groupby
+from random import randint, Random
 from random import seed as rseed
-from .utils import pil_to_tensor, generate_noise
-from .point import Point
+import numpy as np
+import torch
+from . import profiling
+from .cache import LRUCache, env_megabytes
+from .disk_cache import disk_cache
+from .utils import (pil_to_tensor, generate_noise_legacy, block_integers,
+                    generate_block_noise, empty_image)
+from .point import Point, Points
 from .path import Path
+from .placement import Placement, PlacementRule
+from .scene import (Scene, Flower, PathNetwork, NoisyFeature, Star, Polygon,
+                    Ellipses, Stamp, sprite_cache, scaled_length)
+
+# every colour name PIL knows
+FLOWER_COLORS = list(ImageColor.colormap)
+
+
+def boxes_overlap(box1: tuple, box2: tuple) -> bool:
+    return (box1 is not None and box1[0] < box2[2] and box2[0] < box1[2]
+            and box1[1] < box2[3] and box2[1] < box1[3])
 
 
 @dataclass
 class BattlemapMapGenerator:
+    _bg_modes = ["fast", "legacy"]
+    _bg_steps = 5
+    _bg_stream = 0
+    _noise_stream = 1
+    _tile_halo = 32
+    _render_threads = min(8, os.cpu_count() or 1)
+    # bump when a change alters the generated maps, to invalidate the disk
+    # cache
+    _cache_version = 5
+    # rendered backgrounds and layers of the last maps rendered in one piece
+    layer_cache = LRUCache(
+        env_megabytes("BATTLEMAP_LAYER_CACHE_MB", 512),
+        sizeof=lambda image: image.width * image.height * len(image.mode))
+
     @classmethod
     def INPUT_TYPES(cls) -> dict:
         return {"required": {
@@ -20,20 +53,32 @@ class BattlemapMapGenerator:
             "grid_height": ("INT", {"default": 32, "min": 10, "max": 128}),
             "grid_side": ("INT", {"default": 32, "min": 10, "max": 2048}),
             "bg_color": ("STRING", {"default": "#00FF00"}),
-        }
+        },
+            "optional": {
+                "bg_mode": (cls._bg_modes, {"default": "fast"}),
+                "tile_size": ("INT", {"default": 0, "min": 0, "max": 8192,
+                                      "step": 64}),
+                "memmap": ("BOOLEAN", {"default": False, "label_off": "OFF",
+                                       "label_on": "ON"}),
+                "instrumentation": ("BOOLEAN", {"default": False,
+                                                "label_off": "OFF",
+                                                "label_on": "ON"}),
+                "preview_scale": ("FLOAT", {"default": 1.0, "min": 0.05,
+                                            "max": 1.0, "step": 0.05}),
+            }
         }
 
     @classmethod
     @property
     def RETURN_TYPES(cls) -> tuple:
         return ("IMAGE", "INT", "INT",
-                "INT", "INT", "INT")
+                "INT", "INT", "INT", "SCENE", "STRING")
 
     @classmethod
     @property
     def RETURN_NAMES(cls) -> tuple:
         return ("image", "image width", "image height",
-                "grid width", "grid height", "grid side")
+                "grid width", "grid height", "grid side", "scene", "stats")
 
     FUNCTION = "map_generator"
     CATEGORY = "Battlemaps"
@@ -42,9 +87,61 @@ class BattlemapMapGenerator:
         image = Image.new("RGBA", (width, height), bg_color)
         return image
 
-    def generate_bg(self, image: Image, draw: ImageDraw.Draw, bg_color: str):
+    def generate_bg(self, image: Image, draw: ImageDraw.Draw, scene: Scene,
+                    origin: Point = Point(0, 0)):
+        with profiling.stage("render/background"):
+            if scene.bg_mode == "fast":
+                self.generate_bg_fast(image, scene, origin)
+            elif scene.bg_mode == "legacy":
+                rseed(scene.seed)
+                self.generate_bg_legacy(image, draw, scene.bg_color)
+            else:
+                raise ValueError(
+                    f"Unknown background mode: {scene.bg_mode}")
+
+    def generate_bg_fast(self, image: Image, scene: Scene, origin: Point,
+                         band_height: int = 255):
+        """
+        Array version of generate_bg_legacy: a low resolution grid of
+        random colours, one cell every `steps` pixels, upsampled with the
+        same disc shaped blots the legacy mode draws with ellipses.
+        """
+        # as many cells per map at any scale
+        steps = scaled_length(self._bg_steps, scene.scale)
+        half = steps // 2
+        left, top = max(0, origin.x), max(0, origin.y)
+        right = min(scene.width, origin.x + image.width)
+        bottom = min(scene.height, origin.y + image.height)
+        if left >= right or top >= bottom:
+            return
+        color = np.array(ImageColor.getcolor(scene.bg_color, "RGB"),
+                         dtype=np.int16)
+        cell_box = ((left + half) // steps, (top + half) // steps,
+                    (right - 1 + half) // steps + 1,
+                    (bottom - 1 + half) // steps + 1)
+        cells = block_integers((scene.seed, self._bg_stream), cell_box,
+                               -100, 100)
+        cells = np.minimum(np.abs(cells + color), 255).astype(np.uint8)
+
+        offsets = np.arange(steps) - half
+        disc = (offsets[:, None] ** 2 + offsets[None, :] ** 2
+                <= half ** 2 + 1)
+        columns = np.arange(left, right) + half
+        cell_x, disc_x = columns // steps - cell_box[0], columns % steps
+        for y in range(top, bottom, band_height):
+            rows = np.arange(y, min(y + band_height, bottom)) + half
+            cell_y, disc_y = rows // steps - cell_box[1], rows % steps
+            band = cells[cell_y[:, None], cell_x[None, :]]
+            band[~disc[disc_y[:, None], disc_x[None, :]]] = color
+            image.paste(Image.fromarray(band, "RGB"),
+                        (left - origin.x, y - origin.y))
+        generate_block_noise(image, origin, (left, top, right, bottom),
+                             (scene.seed, self._noise_stream))
+
+    def generate_bg_legacy(self, image: Image, draw: ImageDraw.Draw,
+                           bg_color: str):
         r, g, b = ImageColor.getcolor(bg_color, "RGB")
-        steps = 5
+        steps = self._bg_steps
         for x in range(0, image.width + steps, steps):
             for y in range(0, image.height + steps, steps):
                 color = (min(abs(r + randint(-100, 100)), 255),
@@ -53,27 +150,235 @@ class BattlemapMapGenerator:
                 point1 = Point(x - int(steps / 2), y - int(steps / 2))
                 point2 = Point(x + int(steps / 2), y + int(steps / 2))
                 draw.ellipse([point1.coord(), point2.coord()], fill=color)
-        generate_noise(image, Point(0, 0), Point(image.width, image.height))
+                profiling.count("draw_calls")
+        generate_noise_legacy(image, Point(0, 0),
+                              Point(image.width, image.height))
+
+    def generate_scene(self, seed: int, width: int, height: int,
+                       bg_color: str, bg_mode: str = "fast",
+                       grid_side: int = 0) -> Scene:
+        return Scene(seed, width, height, bg_color, bg_mode,
+                     grid_side=grid_side)
+
+    def layer_rng(self, seed: int, layer: str) -> Random:
+        """
+        Independent random stream for one layer, so that toggling a layer
+        does not move the features of the others.
+        """
+        return Random(f"{seed}:{layer}")
+
+    def tiles(self, scene: Scene, tile_size: int):
+        if not tile_size or scene.bg_mode == "legacy":
+            yield 0, 0, scene.width, scene.height
+            return
+        for top in range(0, scene.height, tile_size):
+            for left in range(0, scene.width, tile_size):
+                yield (left, top, min(left + tile_size, scene.width),
+                       min(top + tile_size, scene.height))
+
+    def render_layer(self, scene: Scene, origin: Point, size: tuple,
+                     name: str, features: list) -> Image:
+        with profiling.stage(f"render/{name}"):
+            layer = Image.new("RGBA", size, (0, 0, 0, 0))
+            for kind, run in groupby(features, type):
+                if kind is Flower:
+                    # small and many, drawn in a single batch
+                    Flower.draw_all(layer, list(run), origin)
+                    continue
+                for feature in run:
+                    self.render_feature(scene, layer, origin, feature)
+            return layer
+
+    def render_feature(self, scene: Scene, layer: Image, origin: Point,
+                       feature):
+        if isinstance(feature, Stamp):
+            feature.paste(layer, origin)
+            return
+        feature.draw(layer, origin)
+        if isinstance(feature, NoisyFeature):
+            noise_box = feature.noise_box()
+            generate_block_noise(layer, origin, (
+                max(0, noise_box[0]), max(0, noise_box[1]),
+                min(scene.width, noise_box[2]),
+                min(scene.height, noise_box[3])), (feature.noise_seed,))
+
+    def render_tile(self, scene: Scene, box: tuple, halo: int = 0,
+                    layers: list = None, executor: Executor = None,
+                    memoize: bool = False) -> Image:
+        """
+        Rasterize the part of the scene inside box, drawing on a canvas
+        extended by halo pixels on every side so that strokes crossing the
+        tile border are clipped the same way whatever the tiling. Each
+        layer is drawn on its own, on the executor when one is given, and
+        composited over the background in the scene order. With memoize,
+        the background and the layers are kept in the layer cache.
+        """
+        if layers is None:
+            layers = self.layer_bboxes(scene)
+        origin = Point(box[0] - halo, box[1] - halo)
+        size = (box[2] - box[0] + 2 * halo, box[3] - box[1] + 2 * halo)
+        canvas_box = (origin.x, origin.y,
+                      origin.x + size[0], origin.y + size[1])
+        visible_layers = list()
+        for name, features in layers:
+            features = [feature for feature, bbox in features
+                        if boxes_overlap(bbox, canvas_box)]
+            if features:
+                visible_layers.append((name, features))
+
+        def render_layer(layer: tuple) -> Image:
+            name = layer[0]
+            key = scene.layer_keys.get(name)
+            return self.memoized(
+                None if key is None or not memoize
+                else (key, scene.scale, canvas_box),
+                lambda: self.render_layer(scene, origin, size, *layer))
+
+        def render_background() -> Image:
+            canvas = self.generate_image(*size, scene.bg_color)
+            self.generate_bg(canvas, ImageDraw.Draw(canvas), scene, origin)
+            return canvas
+
+        profiling.count("tiles")
+        if executor is not None:
+            rendered = executor.map(profiling.in_context(render_layer),
+                                    visible_layers)
+        else:
+            rendered = map(render_layer, visible_layers)
+        canvas = self.memoized(
+            ("background", scene.seed, scene.width, scene.height,
+             scene.bg_color, scene.bg_mode, scene.scale, canvas_box)
+            if memoize else None, render_background)
+        if memoize:
+            canvas = canvas.copy()
+        for layer in rendered:
+            with profiling.stage("render/composite"):
+                canvas.alpha_composite(layer)
+        return canvas.crop((halo, halo, canvas.width - halo,
+                            canvas.height - halo))
+
+    def memoized(self, key: tuple, render) -> Image:
+        """
+        Return render(), from the layer cache when it holds key. The images
+        are shared and must not be modified. Not cached when key is None.
+        """
+        if key is None:
+            return render()
+        image = self.layer_cache.get(key)
+        if image is not None:
+            profiling.count("layer_cache_hits")
+            return image
+        profiling.count("layer_cache_misses")
+        return self.layer_cache.put(key, render())
+
+    def layer_bboxes(self, scene: Scene) -> list:
+        return [(name, [(feature, feature.bbox()) for feature in features])
+                for name, features in scene.layers.items()]
+
+    def render_scene(self, scene: Scene, tile_size: int = 0,
+                     memmap: bool = False) -> torch.Tensor:
+        """
+        Rasterize the scene tile by tile straight into the output IMAGE,
+        so that the extra memory depends on the tile size only.
+        """
+        image_tensor_out = empty_image(1, scene.height, scene.width, memmap)
+        layers = self.layer_bboxes(scene)
+        # the legacy background is drawn in a single piece, from the origin
+        halo = 0 if scene.bg_mode == "legacy" else self._tile_halo
+        with ThreadPoolExecutor(self._render_threads) as executor:
+            for left, top, right, bottom in self.tiles(scene, tile_size):
+                # tiles bound the memory, which the layer cache would not
+                tile = self.render_tile(scene, (left, top, right, bottom),
+                                        halo, layers, executor,
+                                        memoize=not tile_size)
+                with profiling.stage("render/pil_to_tensor"):
+                    pil_to_tensor(tile,
+                                  image_tensor_out[0, top:bottom, left:right])
+        return image_tensor_out
 
     def _map_generator(self, seed: int, grid_width: int, grid_height: int,
-                       grid_side: int, bg_color: str) -> tuple:
-        rseed(seed)
+                       grid_side: int, bg_color: str,
+                       bg_mode: str = "fast") -> tuple:
         width, height = grid_width * grid_side, grid_height * grid_side
-        image_pil = self.generate_image(width, height, bg_color)
-        draw = ImageDraw.Draw(image_pil)
-        self.generate_bg(image_pil, draw, bg_color)
+        scene = self.generate_scene(seed, width, height, bg_color, bg_mode,
+                                    grid_side)
+        return (scene, width, height, grid_width, grid_height, grid_side)
+
+    def render_map(self, scene: Scene, tile_size: int = 0,
+                   memmap: bool = False, scale: float = 1.0) -> tuple:
+        """
+        Render the scene with its geometry multiplied by scale: the layout
+        does not depend on the resolution, so that a preview is a thumbnail
+        of the full size map. The sizes describe the image.
+        """
+        grid_width = scene.width // scene.grid_side
+        grid_height = scene.height // scene.grid_side
+        if scale != 1:
+            scene = scene.scaled(scale)
+        return (self.render_scene(scene, tile_size, memmap),
+                scene.width, scene.height, grid_width, grid_height,
+                scene.grid_side)
+
+    def cached(self, params: tuple, memmap: bool, generate) -> tuple:
+        """
+        Return generate(), an IMAGE followed by JSON serializable outputs,
+        from the disk cache when it holds the result for params.
+        """
+        key = disk_cache.key(type(self).__name__, self._cache_version,
+                             *params)
+        with profiling.stage("disk_cache/load"):
+            entry = disk_cache.get(key)
+        if entry is not None:
+            profiling.count("disk_cache_hits")
+            image_pil, outputs = entry
+            image = empty_image(1, image_pil.height, image_pil.width, memmap)
+            pil_to_tensor(image_pil, image[0])
+            return (image, *outputs)
+        result = generate()
+        if disk_cache.enabled:
+            profiling.count("disk_cache_misses")
+            with profiling.stage("disk_cache/store"):
+                disk_cache.put(key, result[0][0], result[1:])
+        return result
 
-        return (image_pil, width, height, grid_width, grid_height, grid_side)
+    def generate_map(self, seed: int, grid_width: int, grid_height: int,
+                     grid_side: int, bg_color: str, bg_mode: str = "fast",
+                     tile_size: int = 0, memmap: bool = False,
+                     preview_scale: float = 1.0) -> tuple:
+        scene, width, height, grid_width, grid_height, grid_side = self._map_generator(
+            seed, grid_width, grid_height, grid_side, bg_color, bg_mode)
+        return (*self.render_map(scene, tile_size, memmap, preview_scale),
+                scene.to_dict())
 
     def map_generator(self, seed: int, grid_width: int, grid_height: int,
-                      grid_side: int, bg_color: str) -> tuple:
-        image_pil, width, height, grid_width, grid_height, grid_side = self._map_generator(
-            seed, grid_width, grid_height, grid_side, bg_color)
-        return (pil_to_tensor(image_pil),
-                width, height, grid_width, grid_height, grid_side)
+                      grid_side: int, bg_color: str,
+                      bg_mode: str = "fast", tile_size: int = 0,
+                      memmap: bool = False, instrumentation: bool = False,
+                      preview_scale: float = 1.0) -> tuple:
+        with profiling.profile(type(self).__name__,
+                               instrumentation) as profiler:
+            result = self.cached(
+                (seed, grid_width, grid_height, grid_side, bg_color,
+                 bg_mode, preview_scale), memmap,
+                lambda: self.generate_map(seed, grid_width, grid_height,
+                                          grid_side, bg_color, bg_mode,
+                                          tile_size, memmap, preview_scale))
+        return (*result, profiler.to_json() if profiler else "")
 
 
 class BattlemapMapGeneratorOutdoors(BattlemapMapGenerator):
+    # features keep off the paths and, by kind, off each other
+    _placement_rules = {
+        "flowers": PlacementRule(400, spacing={"flowers": 6},
+                                 exclude=("rivers", "roads")),
+        "rocks": PlacementRule(10, spacing={"rocks": 80},
+                               exclude=("rivers", "roads"), clearance=10),
+        # about 100 trees on the default 24x32 grid, at most one per cell
+        "trees": PlacementRule(100, spacing={"trees": 40, "rocks": 50},
+                               exclude=("rivers", "roads"), clearance=15,
+                               density=0.13),
+    }
+
     @classmethod
     def INPUT_TYPES(cls):
         inputs = super().INPUT_TYPES()
@@ -94,182 +399,284 @@ class BattlemapMapGeneratorOutdoors(BattlemapMapGenerator):
             "positive": ("STRING", {"default": '', "multiline": True}),
             "negative": ("STRING", {"default": '', "multiline": True}),
         })
+        inputs['optional'].update({
+            "variants": ("INT", {"default": 32, "min": 0, "max": 1024}),
+        })
         return inputs
 
     @classmethod
     @property
     def RETURN_TYPES(cls) -> tuple:
         return_types = list(super().RETURN_TYPES)
-        return_types.extend(["STRING", "STRING"])
+        # the scene and stats outputs stay last
+        return_types[-2:-2] = ["STRING", "STRING"]
         return tuple(return_types)
 
     @classmethod
     @property
     def RETURN_NAMES(cls) -> tuple:
         return_names = list(super().RETURN_NAMES)
-        return_names.extend(["positive prompt", "negative prompt"])
+        return_names[-2:-2] = ["positive prompt", "negative prompt"]
         return tuple(return_names)
 
-    def generator_flowers(self, image: Image, draw: ImageDraw.Draw):
-        for _ in range(100, 500):
-            point = Point(randint(0, image.width), randint(0, image.height))
-            size = randint(2, 6)
-            draw.ellipse([(point - size).coord(), (point + size).coord()],
-                         fill=choice(list(ImageColor.colormap.keys())),
-                         outline="black", width=2)
+    def generator_flowers(self, scene: Scene, placement: Placement
+                          ) -> list[Flower]:
+        flowers = list()
+        for point, rng in placement.sample(scene.seed, "flowers",
+                                           self._placement_rules["flowers"]):
+            size = rng.randint(2, 6)
+            flowers.append(Flower(point, size,
+                                  rng.choice(FLOWER_COLORS)))
+        return flowers
 
-    def start_point(self, image: Image) -> tuple[Point, int]:
-        match randint(0, 3):
+    def start_point(self, scene: Scene, rng: Random) -> tuple[Point, int]:
+        match rng.randint(0, 3):
             case 0:
-                point = Point(randint(0, image.width), -10)
+                point = Point(rng.randint(0, scene.width), -10)
             case 1:
-                point = Point(randint(0, image.width), image.height + 10)
+                point = Point(rng.randint(0, scene.width), scene.height + 10)
             case 2:
-                point = Point(-10, randint(0, image.height))
+                point = Point(-10, rng.randint(0, scene.height))
             case 3:
-                point = Point(image.width + 10, randint(0, image.height))
-        angle = point.angle_between(Point(image.width / 2, image.height / 2))
-        return point, angle + randint(-45, 45)
+                point = Point(scene.width + 10, rng.randint(0, scene.height))
+        angle = point.angle_between(Point(scene.width / 2, scene.height / 2))
+        return point, angle + rng.randint(-45, 45)
 
-    def generate_path(self, image: Image, paths: list[Path],
+    def generate_path(self, scene: Scene, rng: Random, paths: list[Path],
                       start_point: Point, start_angle: int,
                       width: int = 20,
                       depth: int = 0, depth_max: int = 5):
         if depth > depth_max or width <= 5:
             return
-        point1, angle, length = start_point, start_angle, randint(100, 150)
+        point1, angle, length = start_point, start_angle, rng.randint(100, 150)
         path = Path(width=width)
         path.add_point(point1)
-        while -10 <= point1.x <= image.width + 10 and -10 <= point1.y <= image.height + 10:
+        while -10 <= point1.x <= scene.width + 10 and -10 <= point1.y <= scene.height + 10:
             point2 = point1.add_polar(length, angle)
             path.add_point(point2)
-            match randint(0, 20):
+            match rng.randint(0, 20):
                 case 0:
                     break
                 case 1 | 2:
-                    new_angle = angle + randint(10, 30) * choice([-1, 1])
-                    self.generate_path(image, paths, point1, new_angle,
+                    new_angle = angle + rng.randint(10, 30) * rng.choice([-1, 1])
+                    self.generate_path(scene, rng, paths, point1, new_angle,
                                        width=math.ceil(width * 2 / 3),
                                        depth=depth + 1, depth_max=depth_max)
-            point1, angle, length = (point2, angle + randint(-20, 20),
-                                     randint(20, 200))
+            point1, angle, length = (point2, angle + rng.randint(-20, 20),
+                                     rng.randint(20, 200))
+        profiling.count("path_segments", len(path) - 1)
         paths.append(path)
 
-    def draw_path(self, draw: ImageDraw.Draw, color: str, paths: list):
-        width_max = 0
-        for path in paths:
-            width_max = max(width_max, path.width)
-            draw.line(path.coord(), fill="black", width=path.width + 2,
-                      joint="curve")
-        for i in range(width_max, 0, -1):
-            h, s, v = rgb_to_hsv(*ImageColor.getcolor(color, "RGB"))
-            r, g, b = map(int, hsv_to_rgb(h, s, v / i ** 0.3))
-            for path in filter(lambda x: x.width <= width_max, paths):
-                draw.line(path.coord(), fill=(r, g, b), width=i, joint="curve")
-
-    def generate_rivers(self, image: Image, draw: ImageDraw.Draw):
-        point, angle = self.start_point(image)
-        paths = list()
-        self.generate_path(image, paths, point, angle)
-        self.draw_path(draw, "blue", paths)
-
-    def generate_roads(self, image: Image, draw: ImageDraw.Draw):
-        point, angle = self.start_point(image)
-        paths = list()
-        self.generate_path(image, paths, point, angle)
-        self.draw_path(draw, "saddlebrown", paths)
-
-    def generate_stars(self, image: Image, draw: ImageDraw.Draw,
-                       size_color: list):
-        center = Point(randint(0, image.width), randint(0, image.height))
-        size_multiplicator = random()
+    def generate_rivers(self, scene: Scene, rng: Random) -> list[PathNetwork]:
+        point, angle = self.start_point(scene, rng)
+        rivers = PathNetwork("blue")
+        self.generate_path(scene, rng, rivers.paths, point, angle)
+        return [rivers]
+
+    def generate_roads(self, scene: Scene, rng: Random) -> list[PathNetwork]:
+        point, angle = self.start_point(scene, rng)
+        roads = PathNetwork("saddlebrown")
+        self.generate_path(scene, rng, roads.paths, point, angle)
+        return [roads]
+
+    def random_point(self, scene: Scene, rng: Random) -> Point:
+        return Point(rng.randint(0, scene.width), rng.randint(0, scene.height))
+
+    def generate_stars(self, scene: Scene, rng: Random,
+                       size_color: list, center: Point = None) -> Star:
+        if center is None:
+            center = self.random_point(scene, rng)
+        size_multiplicator = rng.random()
+        layers = list()
+        angles = range(0, 360, 5)
         for size, color in size_color:
-            for angle in range(0, 360, 5):
-                length = max(size / 5, size * random() * size_multiplicator)
-                point = center.add_polar(length, angle)
-                witdh = randint(5, 10)
-                draw.line([center.coord(), point.coord()],
-                          fill="black", width=witdh + 2)
-                draw.line([center.coord(), point.coord()],
-                          fill=color, width=witdh)
-        generate_noise(image, center - size, center + size, 10)
-
-    def generate_polygon(self, image: Image, draw: ImageDraw.Draw,
-                         size_color: list, nb_point: int):
-        center = Point(randint(0, image.width), randint(0, image.height))
-        size_multiplicator = max(0.5, random())
+            lengths, widths = list(), list()
+            for _ in angles:
+                lengths.append(max(size / 5,
+                                   size * rng.random() * size_multiplicator))
+                widths.append(rng.randint(5, 10))
+            layers.append((color, Points.polar(center, lengths, angles),
+                           widths))
+        return Star(center, size, rng.getrandbits(64), layers)
+
+    def generate_polygon(self, scene: Scene, rng: Random, size_color: list,
+                         nb_point: int, center: Point = None) -> Polygon:
+        if center is None:
+            center = self.random_point(scene, rng)
+        size_multiplicator = max(0.5, rng.random())
+        layers = list()
+        angles = range(0, 360, int(360 / nb_point))
         for size, color in size_color:
-            point_list = list()
-            for angle in range(0, 360, int(360 / nb_point)):
-                length = max(size / 5, size * random() * size_multiplicator)
-                point = center.add_polar(length, angle)
-                point_list.append(point.coord())
-            draw.polygon(point_list, fill=color, outline="black", width=2)
-        generate_noise(image, center - size, center + size, 10)
-
-    def generate_ellipses(self, image: Image, draw: ImageDraw.Draw,
-                          size_color: list):
-        center = Point(randint(0, image.width), randint(0, image.height))
-        size_multiplicator = random()
+            lengths = [max(size / 5, size * rng.random() * size_multiplicator)
+                       for _ in angles]
+            layers.append((color, Points.polar(center, lengths, angles)))
+        return Polygon(center, size, rng.getrandbits(64), layers)
+
+    def generate_ellipses(self, scene: Scene, rng: Random,
+                          size_color: list) -> Ellipses:
+        center = self.random_point(scene, rng)
+        size_multiplicator = rng.random()
         size_max = 0
+        layers = list()
         for size, color in size_color:
             size_max = max(size_max, math.ceil(size * size_multiplicator))
-            point1 = center - math.ceil(size * size_multiplicator) - randint(0,
+            point1 = center - math.ceil(size * size_multiplicator) - rng.randint(0,
                                                                              10)
-            point2 = center + math.ceil(size * size_multiplicator) + randint(0,
+            point2 = center + math.ceil(size * size_multiplicator) + rng.randint(0,
                                                                              10)
-            draw.ellipse([point1.coord(), point2.coord()],
-                         fill=color, outline="black", width=2)
-        generate_noise(image, center - size_max, center + size_max, 10)
-
-    def generate_rocks(self, image: Image, draw: ImageDraw.Draw):
-        for _ in range(10):
-            self.generate_polygon(image, draw, [(50, "#111111"),
-                                                (35, "darkgray"),
-                                                (25, "gray")],
-                                  choice([3, 4, 5, 6, 8, 9]))
-
-    def generate_trees(self, image: Image, draw: ImageDraw.Draw):
-        for _ in range(100):
-            self.generate_stars(image, draw, [(45, "darkgray"),
-                                              (40, "darkgreen"),
-                                              (30, "green"),
-                                              (20, "lightgreen")])
+            layers.append((color, point1, point2))
+        return Ellipses(center, size_max, rng.getrandbits(64), layers)
 
-    def map_generator(self, seed: int, grid_width: int, grid_height: int,
-                      grid_side: int, bg_color: str,
-                      river: bool=False, road: bool=False,
-                      rocks: bool=False, trees: bool=False,
-                      positive: str = "", negative: str = ""):
-        rseed(seed)
-        image, width, height, grid_width, grid_height, grid_side = (
+    def generate_stamp(self, key: tuple, generate_template, center: Point,
+                       templates: dict) -> Stamp:
+        """
+        Place an instance of a library variant. The variant is generated
+        around (0, 0) from its own stream, so that its sprite can be reused
+        across maps. The sprite is rendered when first pasted, at the scale
+        the scene is rendered at.
+        """
+        sprite = sprite_cache.get(key)
+        if sprite is not None:
+            return Stamp(center, key, sprite.template)
+        template = templates.get(key)
+        if template is None:
+            template = templates[key] = generate_template(Random(repr(key)),
+                                                          Point(0, 0))
+        return Stamp(center, key, template)
+
+    def generate_rocks(self, scene: Scene, placement: Placement,
+                       variants: int = 0) -> list:
+        size_color = [(50, "#111111"), (35, "darkgray"), (25, "gray")]
+
+        def generate_rock(rng: Random, center: Point = None) -> Polygon:
+            return self.generate_polygon(scene, rng, size_color,
+                                         rng.choice([3, 4, 5, 6, 8, 9]),
+                                         center)
+
+        centers = placement.sample(scene.seed, "rocks",
+                                   self._placement_rules["rocks"])
+        templates = dict()
+        if variants:
+            return [self.generate_stamp(
+                ("rocks", rng.randrange(variants), *size_color),
+                generate_rock, center, templates) for center, rng in centers]
+        return [generate_rock(rng, center) for center, rng in centers]
+
+    def generate_trees(self, scene: Scene, placement: Placement,
+                       variants: int = 0) -> list:
+        size_color = [(45, "darkgray"), (40, "darkgreen"), (30, "green"),
+                      (20, "lightgreen")]
+
+        def generate_tree(rng: Random, center: Point = None) -> Star:
+            return self.generate_stars(scene, rng, size_color, center)
+
+        centers = placement.sample(scene.seed, "trees",
+                                   self._placement_rules["trees"])
+        templates = dict()
+        if variants:
+            return [self.generate_stamp(
+                ("trees", rng.randrange(variants), *size_color),
+                generate_tree, center, templates) for center, rng in centers]
+        return [generate_tree(rng, center) for center, rng in centers]
+
+    def generate_map(self, seed: int, grid_width: int, grid_height: int,
+                     grid_side: int, bg_color: str,
+                     river: bool = False, road: bool = False,
+                     rocks: bool = False, trees: bool = False,
+                     positive: str = "", negative: str = "",
+                     bg_mode: str = "fast", tile_size: int = 0,
+                     memmap: bool = False, variants: int = 32,
+                     preview_scale: float = 1.0) -> tuple:
+        scene, width, height, grid_width, grid_height, grid_side = (
             self._map_generator(seed, grid_width, grid_height, grid_side,
-                                bg_color))
-        draw = ImageDraw.Draw(image)
-        self.generator_flowers(image, draw)
+                                bg_color, bg_mode))
+        # paths first, for the other features to avoid them, but the layers
+        # are drawn in the order flowers, rivers, roads, rocks, trees; the
+        # features turned off still take their place, so that no other
+        # feature moves
+        layers = dict()
+        placement = Placement(width, height, grid_side)
         if river:
-            self.generate_rivers(image, draw)
+            with profiling.stage("scene/rivers"):
+                layers["rivers"] = self.generate_rivers(
+                    scene, self.layer_rng(seed, "rivers"))
+                placement.occupy("rivers", layers["rivers"][0].paths)
+                scene.layer_keys["rivers"] = self.layer_key(scene, "rivers")
             positive += "blue river, water."
         else:
             negative += "blue river, water."
         if road:
-            self.generate_roads(image, draw)
+            with profiling.stage("scene/roads"):
+                layers["roads"] = self.generate_roads(
+                    scene, self.layer_rng(seed, "roads"))
+                placement.occupy("roads", layers["roads"][0].paths)
+                scene.layer_keys["roads"] = self.layer_key(scene, "roads")
             positive += "saddlebrown road."
         else:
             negative += "road."
 
         if rocks:
-            self.generate_rocks(image, draw)
+            with profiling.stage("scene/rocks"):
+                layers["rocks"] = self.generate_rocks(scene, placement,
+                                                      variants)
+                scene.layer_keys["rocks"] = self.layer_key(scene, "rocks",
+                                                           variants)
             positive += "green trees."
         else:
+            placement.reserve(seed, "rocks", self._placement_rules["rocks"])
             negative += "trees."
 
         if trees:
-            self.generate_trees(image, draw)
+            with profiling.stage("scene/trees"):
+                layers["trees"] = self.generate_trees(scene, placement,
+                                                      variants)
+                scene.layer_keys["trees"] = self.layer_key(scene, "trees",
+                                                           variants)
             positive += "gray rocks."
         else:
+            placement.reserve(seed, "trees", self._placement_rules["trees"])
             negative += "rocks."
 
-        return (pil_to_tensor(image),
-                width, height, grid_width, grid_height, grid_side,
-                positive, negative)
+        with profiling.stage("scene/flowers"):
+            layers["flowers"] = self.generator_flowers(scene, placement)
+            scene.layer_keys["flowers"] = self.layer_key(scene, "flowers")
+        for name in ("flowers", "rivers", "roads", "rocks", "trees"):
+            if name in layers:
+                scene.layers[name] = layers[name]
+
+        return (*self.render_map(scene, tile_size, memmap, preview_scale),
+                positive, negative, scene.to_dict())
+
+    def layer_key(self, scene: Scene, name: str, *params) -> tuple:
+        """
+        Key of the content of a layer generated from params, and from the
+        paths that hide its features. The kinds it keeps its distances to
+        are placed whether they are drawn or not.
+        """
+        rule = self._placement_rules.get(name)
+        depends = () if rule is None else rule.exclude
+        return (type(self).__name__, scene.seed, scene.width, scene.height,
+                scene.grid_side, name, *params,
+                *(scene.layer_keys.get(layer) for layer in depends))
+
+    def map_generator(self, seed: int, grid_width: int, grid_height: int,
+                      grid_side: int, bg_color: str,
+                      river: bool=False, road: bool=False,
+                      rocks: bool=False, trees: bool=False,
+                      positive: str = "", negative: str = "",
+                      bg_mode: str = "fast", tile_size: int = 0,
+                      memmap: bool = False, instrumentation: bool = False,
+                      variants: int = 32, preview_scale: float = 1.0):
+        with profiling.profile(type(self).__name__,
+                               instrumentation) as profiler:
+            result = self.cached(
+                (seed, grid_width, grid_height, grid_side, bg_color, river,
+                 road, rocks, trees, positive, negative, bg_mode, variants,
+                 preview_scale),
+                memmap,
+                lambda: self.generate_map(seed, grid_width, grid_height,
+                                          grid_side, bg_color, river, road,
+                                          rocks, trees, positive, negative,
+                                          bg_mode, tile_size, memmap,
+                                          variants, preview_scale))
+        return (*result, profiler.to_json() if profiler else "")
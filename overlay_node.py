@@ -0,0 +1,36 @@
+import torch
+from .compass_node import CompassGrid
+from .grid_node import BattlemapGrid
+
+
+class BattlemapOverlay:
+    """
+    BattlemapGrid chained into CompassGrid in a single node, with the same
+    inputs and the same images. The grid is composited into a new IMAGE,
+    into which the compass is then pasted in place, rather than into a copy
+    of it.
+    """
+
+    def __init__(self):
+        self.grid = BattlemapGrid()
+        self.compass = CompassGrid()
+
+    @classmethod
+    def INPUT_TYPES(cls) -> dict:
+        grid = BattlemapGrid.INPUT_TYPES()
+        compass = CompassGrid.INPUT_TYPES()
+        return {"required": {**grid["required"], **compass["required"]},
+                "optional": grid["optional"]}
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("image",)
+    FUNCTION = "overlay"
+    CATEGORY = "Battlemaps"
+
+    def overlay(self, image: torch.Tensor, font: str, cardinals: str,
+                position: str, size: int, seed: int, rotation: int,
+                random_rotation: bool, **grid_inputs) -> tuple:
+        (image,) = self.grid.grid_overlay(image, **grid_inputs)
+        return self.compass.compass_overlay(image, font, cardinals, position,
+                                            size, seed, rotation,
+                                            random_rotation, inplace=True)
@@ -1,14 +1,100 @@
-from dataclasses import dataclass, field
-from .point import Point
+from dataclasses import dataclass
+import numpy as np
+from .point import Point, Points
 
 
-@dataclass
+class PathPoints(list):
+    """
+    The points of a path, the Point objects given to it, with a version
+    that every change increments.
+    """
+    __slots__ = ("version",)
+
+    def __init__(self, points=()):
+        super().__init__(points)
+        self.version = 0
+
+
+def invalidating(name: str):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append",
+             "extend", "insert", "pop", "remove", "clear", "sort",
+             "reverse"):
+    setattr(PathPoints, name, invalidating(name))
+
+
+@dataclass(init=False)
 class Path:
+    """
+    Polyline of a given width. points is the list of the Point added, array
+    the same polyline as an (N, 2) array, that PIL draws as is, of integers
+    as long as every point is on whole pixels. The array is built on first
+    use, and again after the points were changed or handed out, since the
+    Point objects themselves can be modified through them.
+    """
+    __slots__ = ("width", "_points", "_array", "_version")
     width: int
-    points: list[Point] = field(default_factory=list)
+    points: list
+
+    def __init__(self, width: int, points: list = ()):
+        self.width = width
+        self._points = PathPoints(points)
+        self._array = None
+        self._version = 0
+
+    @classmethod
+    def from_array(cls, width: int, array) -> "Path":
+        array = np.asarray(array)
+        if array.dtype.kind not in "iuf":
+            array = array.astype(np.float64)
+        array = array.reshape(-1, 2)
+        path = cls(width, [Point(*point) for point in array.tolist()])
+        path._array = array.copy()
+        path._version = path._points.version
+        return path
 
     def add_point(self, point: Point):
-        self.points.append(point)
+        self._points.append(point)
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None or self._version != self._points.version:
+            self._version = self._points.version
+            if self._points:
+                self._array = np.array([(point.x, point.y)
+                                        for point in self._points])
+            else:
+                self._array = np.empty((0, 2), dtype=np.int64)
+        return self._array
+
+    @property
+    def points(self) -> PathPoints:
+        self._points.version += 1
+        return self._points
+
+    @points.setter
+    def points(self, points: list):
+        self._points = PathPoints(points)
+        self._array = None
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def scaled(self, factor: float) -> "Path":
+        """
+        Path with its points, still on whole pixels if they were, and its
+        width, at least a pixel, multiplied by factor.
+        """
+        return Path.from_array(max(1, round(self.width * factor)),
+                               Points(self.array).scaled(factor).array)
 
-    def coord(self):
-        return [point.coord() for point in self.points]
+    def coord(self) -> list:
+        return [point.coord() for point in self._points]
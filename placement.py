@@ -0,0 +1,192 @@
+import math
+from dataclasses import dataclass, field
+from random import Random
+import numpy as np
+from PIL import Image, ImageDraw
+from . import profiling
+from .path import Path
+from .point import Point
+
+
+@dataclass
+class PlacementRule:
+    """
+    Constraints on the centers of one kind of feature. spacing gives the
+    minimum distance to the features already placed, by kind, and exclude
+    the occupancy layers the center must stay clearance pixels away from.
+    When density is set, it replaces count by a number of features per
+    grid cell, and no cell gets more than its ceiling.
+    """
+    count: int
+    spacing: dict = field(default_factory=dict)
+    exclude: tuple = ()
+    clearance: int = 0
+    density: float = None
+    # candidates drawn per feature before giving up
+    attempts: int = 4
+
+
+class SpatialHash:
+    """
+    Uniform grid of buckets of placed (x, y, kind) centers, so that the
+    features closer than a distance are found among a few buckets.
+    """
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.buckets = dict()
+
+    def cell(self, x: float, y: float) -> tuple:
+        return (math.floor(x / self.cell_size),
+                math.floor(y / self.cell_size))
+
+    def insert(self, point: Point, kind: str):
+        self.buckets.setdefault(self.cell(point.x, point.y), []).append(
+            (point.x, point.y, kind))
+
+    def conflicts(self, point: Point, spacing: dict) -> bool:
+        """
+        Whether a feature of a kind in spacing is closer to point than the
+        spacing of its kind.
+        """
+        reach = max(spacing.values(), default=0)
+        if reach <= 0:
+            return False
+        left, top = self.cell(point.x - reach, point.y - reach)
+        right, bottom = self.cell(point.x + reach, point.y + reach)
+        for cell_x in range(left, right + 1):
+            for cell_y in range(top, bottom + 1):
+                for x, y, kind in self.buckets.get((cell_x, cell_y), ()):
+                    distance = spacing.get(kind)
+                    if (distance is not None and (x - point.x) ** 2
+                            + (y - point.y) ** 2 < distance ** 2):
+                        return True
+        return False
+
+
+class OccupancyBitmap:
+    """
+    Mask of the pixels covered by paths, rasterized at 1 / scale of the
+    map size, with its summed-area table so that whether a box touches a
+    path costs four lookups.
+    """
+
+    def __init__(self, width: int, height: int, paths: list[Path],
+                 scale: int = 4):
+        self.scale = scale
+        image = Image.new("L", (math.ceil(width / scale) + 1,
+                                math.ceil(height / scale) + 1))
+        draw = ImageDraw.Draw(image)
+        for path in paths:
+            if len(path) > 1:
+                draw.line((path.array / scale).ravel().tolist(), fill=1,
+                          width=max(1, math.ceil(path.width / scale)),
+                          joint="curve")
+        mask = np.asarray(image, dtype=np.int32)
+        self.table = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1),
+                              dtype=np.int32)
+        np.cumsum(np.cumsum(mask, axis=0), axis=1, out=self.table[1:, 1:])
+
+    def blocked(self, point: Point, clearance: int = 0) -> bool:
+        height, width = self.table.shape[0] - 1, self.table.shape[1] - 1
+        left = min(max(0, math.floor((point.x - clearance) / self.scale)),
+                   width)
+        top = min(max(0, math.floor((point.y - clearance) / self.scale)),
+                  height)
+        right = min(max(0, math.floor((point.x + clearance) / self.scale)
+                        + 1), width)
+        bottom = min(max(0, math.floor((point.y + clearance) / self.scale)
+                         + 1), height)
+        table = self.table
+        return bool(table[bottom, right] - table[top, right]
+                    - table[bottom, left] + table[top, left])
+
+
+class Placement:
+    """
+    Dart throwing of feature centers: candidates are drawn uniformly and
+    rejected before any feature is generated when they are too close to
+    the features already placed or in a full grid cell. With spacing, the
+    accepted centers are a Poisson-disk sample of the map. The centers on
+    an excluded occupancy layer are placed but hidden, so that the other
+    features do not depend on the occupancy layers.
+    """
+
+    def __init__(self, width: int, height: int, grid_side: int,
+                 cell_size: int = 64):
+        self.width = width
+        self.height = height
+        self.grid_side = grid_side
+        self.index = SpatialHash(cell_size)
+        self.occupancy = dict()
+        self.cell_counts = dict()
+
+    def occupy(self, layer: str, paths: list[Path]):
+        self.occupancy[layer] = OccupancyBitmap(self.width, self.height,
+                                                paths)
+
+    def target(self, rule: PlacementRule) -> int:
+        if rule.density is None:
+            return rule.count
+        cells = (self.width / self.grid_side) * (self.height / self.grid_side)
+        return round(rule.density * cells)
+
+    def hidden(self, point: Point, rule: PlacementRule) -> bool:
+        for layer in rule.exclude:
+            occupancy = self.occupancy.get(layer)
+            if occupancy is not None and occupancy.blocked(point,
+                                                           rule.clearance):
+                return True
+        return False
+
+    def accepts(self, point: Point, kind: str, rule: PlacementRule) -> bool:
+        if rule.density is not None:
+            cell = (kind, point.x // self.grid_side,
+                    point.y // self.grid_side)
+            if self.cell_counts.get(cell, 0) >= math.ceil(rule.density):
+                return False
+        return not self.index.conflicts(point, rule.spacing)
+
+    def add(self, point: Point, kind: str, rule: PlacementRule):
+        self.index.insert(point, kind)
+        if rule.density is not None:
+            cell = (kind, point.x // self.grid_side,
+                    point.y // self.grid_side)
+            self.cell_counts[cell] = self.cell_counts.get(cell, 0) + 1
+
+    def sample(self, seed: int, kind: str, rule: PlacementRule):
+        """
+        Yield the accepted centers that are not hidden, up to the target
+        number, each with the random stream it was drawn from for the
+        feature to be generated from it. Every candidate has its own
+        stream, so that the centers do not depend on the occupancy layers:
+        adding a path only hides the features it covers. Each center is
+        recorded once the caller resumes the generator.
+        """
+        target = self.target(rule)
+        placed = rejected = hidden = 0
+        for index in range(target * rule.attempts):
+            if placed == target:
+                break
+            rng = Random(f"{seed}:{kind}:{index}")
+            point = Point(rng.randint(0, self.width),
+                          rng.randint(0, self.height))
+            if not self.accepts(point, kind, rule):
+                rejected += 1
+                continue
+            if self.hidden(point, rule):
+                hidden += 1
+            else:
+                yield point, rng
+            self.add(point, kind, rule)
+            placed += 1
+        profiling.count("placement_rejected", rejected)
+        profiling.count("placement_hidden", hidden)
+
+    def reserve(self, seed: int, kind: str, rule: PlacementRule):
+        """
+        Place the centers of a kind that is not drawn, for the other kinds
+        to keep the same distances to them whether it is drawn or not.
+        """
+        for _ in self.sample(seed, kind, rule):
+            pass
@@ -1,26 +1,27 @@
 from dataclasses import dataclass
 import math
 from typing import Union
+import numpy as np
 
 
-@dataclass
+@dataclass(slots=True)
 class Point:
     x: int
     y: int
 
     def __add__(self, value: Union[int, float, "Point"]) -> "Point":
-        if isinstance(value, (int, float)):
-            return Point(self.x + value, self.y + value)
+        if isinstance(value, Point):
+            return Point(self.x + value.x, self.y + value.y)
         elif isinstance(value, (tuple, list)):
             return Point(self.x + value[0], self.y + value[1])
-        return Point(self.x + value.x, self.y + value.y)
+        return Point(self.x + value, self.y + value)
 
     def __sub__(self, value: Union[int, float, "Point"]) -> "Point":
-        if isinstance(value, (int, float)):
-            return Point(self.x - value, self.y - value)
+        if isinstance(value, Point):
+            return Point(self.x - value.x, self.y - value.y)
         elif isinstance(value, (tuple, list)):
             return Point(self.x - value[0], self.y - value[1])
-        return Point(self.x - value.x, self.y - value.y)
+        return Point(self.x - value, self.y - value)
 
     def __iter__(self):
         yield self.x
@@ -30,9 +31,76 @@ class Point:
         return (self.x, self.y)
 
     def add_polar(self, length: float, angle: float) -> "Point":
-        return self + Point(
-            round(length * math.cos(angle * math.pi / 180)),
-            -round(length * math.sin(angle * math.pi / 180)))
+        angle = angle * math.pi / 180
+        return Point(self.x + round(length * math.cos(angle)),
+                     self.y - round(length * math.sin(angle)))
 
     def angle_between(self, target: "Point") -> float:
         return math.degrees(math.atan2(self.y - target.y, target.x - self.x))
+
+    def scaled(self, factor: float) -> "Point":
+        """
+        Point multiplied by factor, still on whole pixels if it was.
+        """
+        if isinstance(self.x, int) and isinstance(self.y, int):
+            return Point(round(self.x * factor), round(self.y * factor))
+        return Point(self.x * factor, self.y * factor)
+
+
+class Points:
+    """
+    Batch of points stored as an (N, 2) array, that PIL draws as is.
+    Indexing and iterating give Point objects.
+    """
+    __slots__ = ("array",)
+
+    def __init__(self, array=()):
+        array = np.asarray(array)
+        if array.dtype.kind not in "iuf":
+            array = array.astype(np.float64)
+        self.array = array.reshape(-1, 2)
+
+    @classmethod
+    def polar(cls, center: Point, lengths, angles) -> "Points":
+        """
+        Vectorized Point.add_polar, for as many lengths as angles.
+        """
+        angles = np.asarray(angles, dtype=np.float64) * math.pi / 180
+        lengths = np.asarray(lengths, dtype=np.float64)
+        dx = np.round(lengths * np.cos(angles)).astype(np.int64)
+        dy = np.round(lengths * np.sin(angles)).astype(np.int64)
+        return cls(np.stack([center.x + dx, center.y - dy], axis=1))
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, index: int) -> Point:
+        return Point(*self.array[index].tolist())
+
+    def __iter__(self):
+        for index in range(len(self.array)):
+            yield self[index]
+
+    def __add__(self, value: Union[int, float, Point]) -> "Points":
+        return Points(self.array + tuple(value) if isinstance(
+            value, (Point, tuple, list)) else self.array + value)
+
+    def __sub__(self, value: Union[int, float, Point]) -> "Points":
+        return Points(self.array - tuple(value) if isinstance(
+            value, (Point, tuple, list)) else self.array - value)
+
+    def scaled(self, factor: float) -> "Points":
+        if self.array.dtype.kind in "iu":
+            return Points(np.rint(self.array * factor).astype(
+                self.array.dtype))
+        return Points(self.array * factor)
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, Points)
+                and np.array_equal(self.array, other.array))
+
+    def __repr__(self) -> str:
+        return f"Points({self.array.tolist()})"
+
+    def coord(self) -> np.ndarray:
+        return self.array
@@ -0,0 +1,157 @@
+import json
+import logging
+import mmap
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+from threading import Lock
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+_profiler = ContextVar("battlemap_profiler", default=None)
+
+
+def megabytes(size: int) -> str:
+    return "-" if size is None else f"{size / 2 ** 20:+.1f}MB"
+
+
+def resident_memory() -> int:
+    """
+    Resident set size of the process, None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * mmap.PAGESIZE
+    except OSError:
+        return None
+
+
+class Profiler:
+    """
+    Wall time, call count and resident memory delta per stage, plus free
+    form counters. Stages run on worker threads add up, so the time of a
+    stage can be larger than the total. The memory of the process is shared
+    by its threads, so a stage only gets a memory delta, covering PIL and
+    torch buffers as well, when none of its calls overlapped the work of a
+    thread pool; it is None otherwise.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages = dict()
+        self.counters = dict()
+        self.total = 0.0
+        self.memory = None
+        self._lock = Lock()
+        # calls run through in_context, running and started so far
+        self._parallel = 0
+        self._parallel_calls = 0
+
+    @contextmanager
+    def parallel(self):
+        with self._lock:
+            self._parallel += 1
+            self._parallel_calls += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._parallel -= 1
+
+    @contextmanager
+    def stage(self, name: str):
+        calls = self._parallel_calls
+        memory = resident_memory() if not self._parallel else None
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            if memory is not None and self._parallel_calls == calls:
+                memory = resident_memory() - memory
+            else:
+                memory = None
+            with self._lock:
+                stats = self.stages.setdefault(
+                    name, {"time": 0.0, "calls": 0, "memory": 0})
+                stats["time"] += elapsed
+                stats["calls"] += 1
+                stats["memory"] = (None if memory is None
+                                   or stats["memory"] is None
+                                   else stats["memory"] + memory)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        return {"node": self.name, "total": self.total,
+                "memory": self.memory, "stages": self.stages,
+                "counters": self.counters}
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2)
+
+    def log(self):
+        logger.info("%s: %.3fs, %s resident", self.name, self.total,
+                    megabytes(self.memory))
+        for name, stats in sorted(self.stages.items(),
+                                  key=lambda item: -item[1]["time"]):
+            logger.info("  %-24s %9.3fs %6d calls %9s", name,
+                        stats["time"], stats["calls"],
+                        megabytes(stats["memory"]))
+        for name, value in self.counters.items():
+            logger.info("  %-24s %d", name, value)
+
+
+@contextmanager
+def profile(name: str, enabled: bool = True):
+    """
+    Collect the stages and counters reported while the block runs, on this
+    thread and on the threads started through in_context. Yield None when
+    disabled, so that instrumentation costs a context variable lookup.
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = Profiler(name)
+    token = _profiler.set(profiler)
+    memory = resident_memory()
+    start = perf_counter()
+    try:
+        yield profiler
+    finally:
+        profiler.total = perf_counter() - start
+        if memory is not None:
+            profiler.memory = resident_memory() - memory
+        _profiler.reset(token)
+        profiler.log()
+
+
+def stage(name: str):
+    profiler = _profiler.get()
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def count(name: str, value: int = 1):
+    profiler = _profiler.get()
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+def in_context(func):
+    """
+    Wrap func so that it reports to the current profiler whatever the
+    thread it is called from.
+    """
+    context = copy_context()
+    profiler = _profiler.get()
+    if profiler is None:
+        return lambda *args: context.copy().run(func, *args)
+
+    def run(*args):
+        with profiler.parallel():
+            return context.copy().run(func, *args)
+    return run
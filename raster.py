@@ -0,0 +1,65 @@
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+from . import profiling
+from .point import Point
+
+_colors = dict()
+
+
+def color(name: str, mode: str) -> tuple:
+    """
+    Colour name as the value ImageDraw takes for an image mode, parsed once
+    per name rather than on every call.
+    """
+    key = (name, mode)
+    value = _colors.get(key)
+    if value is None:
+        value = _colors[key] = ImageColor.getcolor(name, mode)
+    return value
+
+
+def draw_ellipses(image: Image.Image, offset: Point, boxes, fills: list,
+                  outlines: list, outline_color: str = "black"):
+    """
+    Batched ImageDraw.ellipse of (N, 4) boxes in plane coordinates, with a
+    fill colour and an outline width each.
+    """
+    boxes = np.asarray(boxes).reshape(-1, 4) - 2 * tuple(offset)
+    draw = ImageDraw.Draw(image)
+    outline_ink = color(outline_color, image.mode)
+    for box, fill, outline in zip(boxes.tolist(), fills, outlines):
+        draw.ellipse(box, fill=color(fill, image.mode), outline=outline_ink,
+                     width=outline)
+    profiling.count("draw_calls", len(boxes))
+
+
+def draw_polygons(image: Image.Image, offset: Point, polygons: list,
+                  fills: list, outline: int = 2,
+                  outline_color: str = "black"):
+    """
+    Batched ImageDraw.polygon, pixel for pixel, of (K, 2) vertex arrays in
+    plane coordinates, in a single drawing session on the part of the image
+    they cover: PIL outlines wider than a pixel through a mask the size of
+    the image it draws on.
+    """
+    polygons = [np.asarray(polygon).reshape(-1, 2) - tuple(offset)
+                for polygon in polygons]
+    if not polygons:
+        return
+    vertices = np.concatenate(polygons)
+    left, top = np.floor(vertices.min(axis=0)).astype(int) - outline - 1
+    right, bottom = np.ceil(vertices.max(axis=0)).astype(int) + outline + 2
+    box = (max(0, int(left)), max(0, int(top)),
+           min(image.width, int(right)), min(image.height, int(bottom)))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return
+    region = image.crop(box)
+    draw = ImageDraw.Draw(region)
+    outline_ink = color(outline_color, region.mode)
+    for polygon, fill in zip(polygons, fills):
+        # PIL outlines array polygons slightly differently than lists
+        draw.polygon((polygon - box[:2]).tolist(),
+                     fill=color(fill, region.mode),
+                     outline=outline_ink, width=outline)
+    image.paste(region, box[:2])
+    profiling.count("draw_calls", len(polygons))
@@ -0,0 +1,454 @@
+import json
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from colorsys import rgb_to_hsv, hsv_to_rgb
+import numpy as np
+from PIL import Image, ImageDraw, ImageColor
+from . import profiling
+from .cache import LRUCache, env_megabytes
+from .point import Point, Points
+from .path import Path
+from .raster import draw_ellipses, draw_polygons
+from .utils import generate_noise
+
+
+def scaled_length(length: int, factor: float) -> int:
+    return max(1, round(length * factor))
+
+
+def as_tuple(value):
+    """
+    Nested lists read back from JSON as the nested tuples they were.
+    """
+    if isinstance(value, list):
+        return tuple(as_tuple(item) for item in value)
+    return value
+
+
+def points_bbox(points, margin: float) -> tuple:
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    (left, top), (right, bottom) = points.min(axis=0), points.max(axis=0)
+    return (float(left) - margin, float(top) - margin,
+            float(right) + margin, float(bottom) + margin)
+
+
+@dataclass
+class Flower:
+    center: Point
+    size: int
+    color: str
+    outline: int = 2
+
+    def bbox(self) -> tuple:
+        return points_bbox([self.center.coord()], self.size + 1)
+
+    def scaled(self, factor: float) -> "Flower":
+        return Flower(self.center.scaled(factor),
+                      max(1, round(self.size * factor)), self.color,
+                      round(self.outline * factor))
+
+    def to_dict(self) -> dict:
+        return {"center": list(self.center), "size": self.size,
+                "color": self.color, "outline": self.outline}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Flower":
+        return cls(Point(*data["center"]), data["size"], data["color"],
+                   data["outline"])
+
+    def draw(self, image: Image.Image, offset: Point):
+        self.draw_all(image, [self], offset)
+
+    @staticmethod
+    def draw_all(image: Image.Image, flowers: list, offset: Point):
+        """
+        Draw the flowers in order, in a single batch.
+        """
+        draw_ellipses(image, offset,
+                      [(flower.center - flower.size).coord()
+                       + (flower.center + flower.size).coord()
+                       for flower in flowers],
+                      [flower.color for flower in flowers],
+                      [flower.outline for flower in flowers])
+
+
+@lru_cache(maxsize=64)
+def path_shades(color: str, width_max: int) -> list:
+    """
+    Colour of the strokes of the widths 1 to width_max of a path network,
+    darker for the wider ones.
+    """
+    h, s, v = rgb_to_hsv(*ImageColor.getcolor(color, "RGB"))
+    return [tuple(map(int, hsv_to_rgb(h, s, v / i ** 0.3)))
+            for i in range(1, width_max + 1)]
+
+
+@dataclass
+class PathNetwork:
+    """
+    Rivers and roads: every path is outlined in black, then shaded with
+    bands from the widest to the narrowest.
+    """
+    color: str
+    paths: list[Path] = field(default_factory=list)
+
+    @property
+    def width_max(self) -> int:
+        return max((path.width for path in self.paths), default=0)
+
+    def scaled(self, factor: float) -> "PathNetwork":
+        return PathNetwork(self.color,
+                           [path.scaled(factor) for path in self.paths])
+
+    def to_dict(self) -> dict:
+        return {"color": self.color,
+                "paths": [{"width": path.width,
+                           "points": path.array.tolist()}
+                          for path in self.paths]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PathNetwork":
+        return cls(data["color"], [Path.from_array(path["width"],
+                                                   path["points"])
+                                   for path in data["paths"]])
+
+    def bbox(self) -> tuple:
+        if not any(len(path) for path in self.paths):
+            return None
+        return points_bbox(np.concatenate([path.array for path in self.paths]),
+                           self.width_max / 2 + 2)
+
+    def draw(self, image: Image.Image, offset: Point):
+        """
+        Outline every path in black, then shade the network with bands, by
+        stroking all the paths from the widest width down to 1.
+        """
+        draw = ImageDraw.Draw(image)
+        coords = [(path.array - tuple(offset)).ravel().tolist()
+                  for path in self.paths]
+        for path, coord in zip(self.paths, coords):
+            draw.line(coord, fill="black", width=path.width + 2,
+                      joint="curve")
+        shades = path_shades(self.color, self.width_max)
+        for width in range(len(shades), 0, -1):
+            for coord in coords:
+                draw.line(coord, fill=shades[width - 1], width=width,
+                          joint="curve")
+        profiling.count("draw_calls", len(coords) * (len(shades) + 1))
+
+
+@dataclass
+class NoisyFeature:
+    """
+    Base class of the features that jitter the colours around their center
+    once drawn.
+    """
+    center: Point
+    noise_size: int
+    noise_seed: int
+    # width of the black outlines, that thinner scaled down features lose
+    outline: int = field(default=2, kw_only=True)
+
+    def noise_box(self, padding: int = 10) -> tuple:
+        return ((self.center - self.noise_size - padding).coord()
+                + (self.center + self.noise_size + padding).coord())
+
+    def scaled(self, factor: float) -> "NoisyFeature":
+        """
+        Same feature with its geometry multiplied by factor, and its line
+        widths kept to at least a pixel.
+        """
+        return type(self)(self.center.scaled(factor),
+                          max(1, round(self.noise_size * factor)),
+                          self.noise_seed,
+                          [self.scaled_layer(layer, factor)
+                           for layer in self.layers],
+                          outline=round(self.outline * factor))
+
+    def to_dict(self) -> dict:
+        return {"center": list(self.center), "noise_size": self.noise_size,
+                "noise_seed": self.noise_seed, "outline": self.outline,
+                "layers": [self.layer_to_list(layer)
+                           for layer in self.layers]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NoisyFeature":
+        return cls(Point(*data["center"]), data["noise_size"],
+                   data["noise_seed"],
+                   [cls.layer_from_list(layer) for layer in data["layers"]],
+                   outline=data["outline"])
+
+
+@dataclass
+class Star(NoisyFeature):
+    # one (color, ends, [width, ...]) entry per layer, drawn in order, with
+    # a ray from the center to each of the Points ends
+    layers: list = field(default_factory=list)
+
+    def bbox(self) -> tuple:
+        points = [self.center.coord()] + [ends.array
+                                          for _, ends, _ in self.layers]
+        width = max((width for _, _, widths in self.layers
+                     for width in widths), default=0)
+        return points_bbox(np.concatenate(points[1:] + [[points[0]]]),
+                           width / 2 + 2)
+
+    @staticmethod
+    def scaled_layer(layer: tuple, factor: float) -> tuple:
+        color, ends, widths = layer
+        return (color, ends.scaled(factor),
+                [max(1, round(width * factor)) for width in widths])
+
+    @staticmethod
+    def layer_to_list(layer: tuple) -> list:
+        color, ends, widths = layer
+        return [color, ends.array.tolist(), widths]
+
+    @staticmethod
+    def layer_from_list(layer: list) -> tuple:
+        color, ends, widths = layer
+        return color, Points(ends), widths
+
+    def draw(self, image: Image.Image, offset: Point):
+        draw = ImageDraw.Draw(image)
+        center = (self.center - offset).coord()
+        for color, ends, widths in self.layers:
+            for end, width in zip((ends - offset).coord().tolist(), widths):
+                line = [center, tuple(end)]
+                if self.outline:
+                    draw.line(line, fill="black", width=width + self.outline)
+                draw.line(line, fill=color, width=width)
+            profiling.count("draw_calls", (2 if self.outline else 1)
+                            * len(widths))
+
+
+@dataclass
+class Polygon(NoisyFeature):
+    # one (color, Points) entry per layer, drawn in order
+    layers: list = field(default_factory=list)
+
+    def bbox(self) -> tuple:
+        return points_bbox(np.concatenate([points.array
+                                           for _, points in self.layers]), 2)
+
+    @staticmethod
+    def scaled_layer(layer: tuple, factor: float) -> tuple:
+        color, points = layer
+        return color, points.scaled(factor)
+
+    @staticmethod
+    def layer_to_list(layer: tuple) -> list:
+        color, points = layer
+        return [color, points.array.tolist()]
+
+    @staticmethod
+    def layer_from_list(layer: list) -> tuple:
+        color, points = layer
+        return color, Points(points)
+
+    def draw(self, image: Image.Image, offset: Point):
+        draw_polygons(image, offset,
+                      [points.array for _, points in self.layers],
+                      [color for color, _ in self.layers], self.outline)
+
+
+@dataclass
+class Ellipses(NoisyFeature):
+    # one (color, point1, point2) entry per layer, drawn in order
+    layers: list = field(default_factory=list)
+
+    def bbox(self) -> tuple:
+        return points_bbox([point.coord() for _, point1, point2 in self.layers
+                            for point in (point1, point2)], 2)
+
+    @staticmethod
+    def scaled_layer(layer: tuple, factor: float) -> tuple:
+        color, point1, point2 = layer
+        return color, point1.scaled(factor), point2.scaled(factor)
+
+    @staticmethod
+    def layer_to_list(layer: tuple) -> list:
+        color, point1, point2 = layer
+        return [color, list(point1), list(point2)]
+
+    @staticmethod
+    def layer_from_list(layer: list) -> tuple:
+        color, point1, point2 = layer
+        return color, Point(*point1), Point(*point2)
+
+    def draw(self, image: Image.Image, offset: Point):
+        draw_ellipses(image, offset,
+                      [point1.coord() + point2.coord()
+                       for _, point1, point2 in self.layers],
+                      [color for color, _, _ in self.layers],
+                      [self.outline] * len(self.layers))
+
+
+@dataclass
+class Sprite:
+    template: NoisyFeature
+    image: Image.Image
+    # position of the top left corner relative to the template center
+    corner: Point
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.width * self.image.height * 4
+
+    @classmethod
+    def render(cls, template: NoisyFeature) -> "Sprite":
+        left, top, right, bottom = template.bbox()
+        corner = Point(math.floor(left), math.floor(top))
+        image = Image.new("RGBA", (math.ceil(right) - corner.x,
+                                   math.ceil(bottom) - corner.y),
+                          (0, 0, 0, 0))
+        template.draw(image, corner)
+        noise_box = template.noise_box()
+        generate_noise(image, Point(*noise_box[:2]) - corner,
+                       Point(*noise_box[2:]) - corner,
+                       rng=np.random.default_rng(template.noise_seed))
+        return cls(template, image, corner - template.center)
+
+
+sprite_cache = LRUCache(env_megabytes("BATTLEMAP_SPRITE_CACHE_MB", 64))
+
+
+@dataclass
+class Stamp:
+    """
+    Instance of a library feature, pasted from its pre-rendered sprite.
+    """
+    center: Point
+    key: tuple
+    # the feature the sprite is rendered from, centered on (0, 0)
+    template: NoisyFeature
+
+    def bbox(self) -> tuple:
+        left, top, right, bottom = self.template.bbox()
+        return (left + self.center.x, top + self.center.y,
+                right + self.center.x, bottom + self.center.y)
+
+    def scaled(self, factor: float) -> "Stamp":
+        # the scaled variants are sprites of their own, rendered once
+        key = self.key + (factor,)
+        sprite = sprite_cache.get(key)
+        if sprite is None:
+            with profiling.stage("render/sprites"):
+                sprite = sprite_cache.put(key, Sprite.render(
+                    self.template.scaled(factor)))
+        return Stamp(self.center.scaled(factor), key, sprite.template)
+
+    def to_dict(self) -> dict:
+        return {"center": list(self.center), "key": self.key,
+                "template": feature_to_dict(self.template)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Stamp":
+        return cls(Point(*data["center"]), as_tuple(data["key"]),
+                   feature_from_dict(data["template"]))
+
+    def sprite(self) -> Sprite:
+        sprite = sprite_cache.get(self.key)
+        if sprite is None:
+            with profiling.stage("render/sprites"):
+                sprite = sprite_cache.put(self.key,
+                                          Sprite.render(self.template))
+        return sprite
+
+    def paste(self, image: Image.Image, offset: Point):
+        sprite = self.sprite()
+        position = self.center + sprite.corner - offset
+        image.paste(sprite.image, position.coord(), sprite.image)
+        profiling.count("stamps")
+
+
+FEATURE_TYPES = {cls.__name__: cls for cls in (Flower, PathNetwork, Star,
+                                                Polygon, Ellipses, Stamp)}
+
+
+def feature_to_dict(feature) -> dict:
+    return {"type": type(feature).__name__, **feature.to_dict()}
+
+
+def feature_from_dict(data: dict):
+    return FEATURE_TYPES[data["type"]].from_dict(data)
+
+
+@dataclass
+class Scene:
+    """
+    Layout of a map: everything the generators decide randomly, so that it
+    can be rasterized afterwards, in one piece or tile by tile.
+    """
+    seed: int
+    width: int
+    height: int
+    bg_color: str
+    bg_mode: str = "fast"
+    # feature lists by layer name, in drawing order
+    layers: dict = field(default_factory=dict)
+    # of the geometry, relative to the generated layout
+    scale: float = 1.0
+    # side of the grid cells, at that scale
+    grid_side: int = 0
+    # what the content of each layer depends on, by layer name, for the
+    # renderers to reuse it; the layers without one are always rendered
+    layer_keys: dict = field(default_factory=dict)
+    _format_version = 1
+
+    def features(self):
+        for features in self.layers.values():
+            yield from features
+
+    def scaled(self, factor: float) -> "Scene":
+        """
+        Same layout with all the geometry multiplied by factor, on a canvas
+        of the matching size.
+        """
+        return Scene(self.seed, scaled_length(self.width, factor),
+                     scaled_length(self.height, factor), self.bg_color,
+                     self.bg_mode,
+                     {name: [feature.scaled(factor) for feature in features]
+                      for name, features in self.layers.items()},
+                     self.scale * factor,
+                     scaled_length(self.grid_side, factor),
+                     dict(self.layer_keys))
+
+    def to_dict(self) -> dict:
+        """
+        JSON serializable description of the scene, that from_dict turns
+        back into the same scene. The templates of the stamps are stored
+        once per variant.
+        """
+        templates = dict()
+        layers = dict()
+        for name, features in self.layers.items():
+            layers[name] = list()
+            for feature in features:
+                data = feature_to_dict(feature)
+                if isinstance(feature, Stamp):
+                    templates.setdefault(json.dumps(data["key"]),
+                                         data.pop("template"))
+                layers[name].append(data)
+        return {"version": self._format_version, "seed": self.seed,
+                "width": self.width, "height": self.height,
+                "bg_color": self.bg_color, "bg_mode": self.bg_mode,
+                "scale": self.scale, "grid_side": self.grid_side,
+                "layers": layers, "templates": templates}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Scene":
+        if data.get("version") != cls._format_version:
+            raise ValueError(
+                f"Unsupported scene version: {data.get('version')}")
+        templates = data["templates"]
+        layers = dict()
+        for name, features in data["layers"].items():
+            layers[name] = [feature_from_dict(
+                {**feature, "template": templates[json.dumps(feature["key"])]}
+                if feature["type"] == "Stamp" else feature)
+                for feature in features]
+        return cls(data["seed"], data["width"], data["height"],
+                   data["bg_color"], data["bg_mode"], layers, data["scale"],
+                   data["grid_side"])
@@ -0,0 +1,47 @@
+from . import profiling
+from .map_node import BattlemapMapGenerator
+from .scene import Scene
+
+
+class BattlemapSceneRenderer(BattlemapMapGenerator):
+    """
+    Rasterize the scene output of a map generator at any grid side, so that
+    a layout can be rendered at several sizes without generating it again.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls) -> dict:
+        optional = super().INPUT_TYPES()["optional"]
+        return {"required": {
+            "scene": ("SCENE",),
+            # 0 keeps the grid side the scene was generated with
+            "grid_side": ("INT", {"default": 0, "min": 0, "max": 2048}),
+        },
+            "optional": {name: optional[name] for name in
+                         ("tile_size", "memmap", "instrumentation")},
+        }
+
+    @classmethod
+    @property
+    def RETURN_TYPES(cls) -> tuple:
+        return ("IMAGE", "INT", "INT",
+                "INT", "INT", "INT", "STRING")
+
+    @classmethod
+    @property
+    def RETURN_NAMES(cls) -> tuple:
+        return ("image", "image width", "image height",
+                "grid width", "grid height", "grid side", "stats")
+
+    FUNCTION = "scene_renderer"
+
+    def scene_renderer(self, scene: dict, grid_side: int = 0,
+                       tile_size: int = 0, memmap: bool = False,
+                       instrumentation: bool = False) -> tuple:
+        with profiling.profile(type(self).__name__,
+                               instrumentation) as profiler:
+            with profiling.stage("scene/load"):
+                scene = Scene.from_dict(scene)
+            scale = grid_side / scene.grid_side if grid_side else 1.0
+            result = self.render_map(scene, tile_size, memmap, scale)
+        return (*result, profiler.to_json() if profiler else "")
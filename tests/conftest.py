@@ -0,0 +1,27 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture(scope="session")
+def battlemap():
+    """
+    The node package, imported the same way ComfyUI does, from its parent
+    directory, so that the relative imports resolve.
+    """
+    sys.path.insert(0, str(ROOT.parent))
+    return importlib.import_module(ROOT.name)
+
+
+@pytest.fixture(autouse=True)
+def no_caches(battlemap, monkeypatch):
+    """
+    Render every map from scratch, whatever the environment configures.
+    """
+    monkeypatch.setattr(battlemap.disk_cache.disk_cache, "directory", None)
+    battlemap.map_node.BattlemapMapGenerator.layer_cache.clear()
+    battlemap.scene.sprite_cache.clear()
@@ -0,0 +1,49 @@
+import json
+import subprocess
+import sys
+
+import pytest
+import torch
+
+from conftest import ROOT
+
+INPUTS = dict(grid_width=5, grid_height=4, grid_side=32, bg_color="#3A7D44",
+              river=True, rocks=True, trees=True)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_frames_match_single_seed_runs(battlemap, workers):
+    batch = battlemap.BattlemapMapGeneratorOutdoorsBatch().batch_generator(
+        20, 3, seeds="20, 31-32", workers=workers, **INPUTS)
+    single = battlemap.BattlemapMapGeneratorOutdoors()
+    seeds = [20, 31, 32]
+    assert [frame["seed"] for frame in json.loads(batch[-1])] == seeds
+    for index, seed in enumerate(seeds):
+        expected = single.map_generator(seed, **INPUTS)
+        assert torch.equal(batch[0][index], expected[0][0])
+    # the outputs but the images are those of the first seed
+    assert batch[1:-2] == single.map_generator(20, **INPUTS)[1:-1]
+
+
+def test_workers_do_not_run_the_host_main_module(tmp_path):
+    # a host loading the package from a directory not on sys.path, as
+    # ComfyUI does, and counting the runs of its main module
+    runs = tmp_path / "runs"
+    host = tmp_path / "host.py"
+    host.write_text(f"""
+import importlib.util, sys
+with open({str(runs)!r}, "a") as file:
+    file.write(__name__ + "\\n")
+if __name__ == "__main__":
+    spec = importlib.util.spec_from_file_location(
+        {ROOT.name!r}, {str(ROOT / "__init__.py")!r},
+        submodule_search_locations=[{str(ROOT)!r}])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = package
+    spec.loader.exec_module(package)
+    package.BattlemapMapGeneratorBatch().batch_generator(
+        1, 4, workers=2, grid_width=2, grid_height=2, grid_side=16,
+        bg_color="#3A7D44")
+""")
+    subprocess.run([sys.executable, str(host)], check=True, cwd=tmp_path)
+    assert runs.read_text().split() == ["__main__"]
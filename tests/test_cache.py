@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+
+@pytest.fixture
+def lru(battlemap):
+    return battlemap.cache.LRUCache(10, sizeof=len)
+
+
+def test_lru_evicts_the_least_recently_used(lru):
+    lru.put("a", "aaaa")
+    lru.put("b", "bbbb")
+    assert lru.get("a") == "aaaa"
+    lru.put("c", "cccc")
+    assert "b" not in lru
+    assert "a" in lru and "c" in lru
+    assert lru.nbytes == 8
+
+
+def test_lru_replaces_a_key_and_skips_oversized_values(lru):
+    lru.put("a", "aaaa")
+    lru.put("a", "aaaaaa")
+    assert lru.nbytes == 6 and len(lru) == 1
+    assert lru.put("b", "b" * 11) == "b" * 11
+    assert "b" not in lru and lru.nbytes == 6
+
+
+def test_lru_evicts_when_shrunk(lru):
+    lru.put("a", "aaaa")
+    lru.put("b", "bbbb")
+    lru.max_bytes = 5
+    assert "a" not in lru and "b" in lru
+    lru.max_bytes = 0
+    assert len(lru) == 0 and lru.nbytes == 0
+
+
+def test_lru_counts_hits_and_misses(lru):
+    lru.put("a", "aaaa")
+    lru.get("a")
+    lru.get("b")
+    assert lru.stats()["hits"] == 1 and lru.stats()["misses"] == 1
+
+
+def frame(value: int) -> torch.Tensor:
+    return torch.full((8, 8, 3), value / 255.0)
+
+
+@pytest.fixture
+def disk(battlemap, tmp_path):
+    return battlemap.disk_cache.DiskCache(str(tmp_path), 2 ** 20)
+
+
+def test_disk_cache_round_trips_images_and_outputs(disk, tmp_path):
+    key = disk.key("map", 1, "#00FF00")
+    assert disk.get(key) is None
+    disk.put(key, frame(200), [8, 8, "prompt"])
+    image, outputs = disk.get(key)
+    assert np.array_equal(np.asarray(image), np.full((8, 8, 3), 200))
+    assert outputs == [8, 8, "prompt"]
+    assert os.listdir(tmp_path) == [f"{key}.png"]
+
+
+def test_disk_cache_evicts_the_oldest_entries(disk, tmp_path):
+    for index in range(3):
+        disk.put(str(index), frame(index), [])
+        os.utime(disk.path(str(index)), (index, index))
+    size = os.path.getsize(disk.path("2"))
+    disk.max_bytes = 2 * size + size // 2
+    # reading an entry makes it the most recently used
+    assert disk.get("0") is not None
+    disk.put("3", frame(3), [])
+    assert sorted(os.listdir(tmp_path)) == ["0.png", "3.png"]
+    assert disk.evictions == 2
+
+
+def test_disk_cache_leaves_nothing_behind_a_failed_write(disk, tmp_path,
+                                                         monkeypatch):
+    disk.put("key", frame(1), ["old"])
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Image.Image, "save", fail)
+    with pytest.raises(OSError):
+        disk.put("key", frame(2), ["new"])
+    assert os.listdir(tmp_path) == ["key.png"]
+    assert disk.get("key")[1] == ["old"]
+
+
+def test_disk_cache_discards_unreadable_entries(disk, tmp_path):
+    (tmp_path / "key.png").write_bytes(b"not a png")
+    assert disk.get("key") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_disabled_disk_cache_stores_nothing(battlemap, tmp_path):
+    disk = battlemap.disk_cache.DiskCache(None, 2 ** 20)
+    disk.put("key", frame(1), [])
+    assert disk.get("key") is None and not disk.enabled
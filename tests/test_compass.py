@@ -0,0 +1,45 @@
+import numpy as np
+import torch
+
+from conftest import ROOT
+
+FONT = str(ROOT / "benchmarks" / "fonts" / "DejaVuSans.ttf")
+
+
+def test_compass_only_changes_its_box(battlemap):
+    node = battlemap.CompassGrid()
+    # whole 8 bit levels, which every conversion keeps
+    images = torch.randint(0, 256, (2, 200, 240, 3),
+                           generator=torch.Generator().manual_seed(0)) / 255
+    result = node.compass_overlay(images, FONT, "NWSE", "bottom right", 40,
+                                  0, 30, False)[0]
+
+    changed = (result != images).any(dim=-1).any(dim=0).nonzero()
+    sprite, corner = node.get_sprite(FONT, "NWSE", 40, 30)
+    corner = node.get_center_position(240, 200, "bottom right", 40) + corner
+    assert changed[:, 0].min() >= corner.y
+    assert changed[:, 0].max() < corner.y + sprite.height
+    assert changed[:, 1].min() >= corner.x
+    assert changed[:, 1].max() < corner.x + sprite.width
+
+    # the same pixels as pasting the sprite into the whole frame
+    for image, frame in zip(images, result):
+        expected = battlemap.utils.tensor_to_pil(image)
+        expected.paste(sprite, corner.coord(), sprite)
+        assert np.array_equal(battlemap.utils.tensor_to_uint8(frame),
+                              np.asarray(expected))
+
+
+def test_overlay_matches_the_chained_nodes(battlemap):
+    images = torch.rand((2, 200, 240, 3),
+                        generator=torch.Generator().manual_seed(1))
+    compass = ("NWSE", "top left", 40, 5, 0, True)
+    grid = dict(grid_type="horizontal hexagon", grid_side=32, line_width=2,
+                red=255, green=0, blue=0, alpha=128)
+    chained = battlemap.BattlemapGrid().grid_overlay(images, **grid)[0]
+    chained = battlemap.CompassGrid().compass_overlay(chained, FONT,
+                                                      *compass)[0]
+    fused = battlemap.BattlemapOverlay().overlay(images, FONT, *compass,
+                                                 **grid)[0]
+    assert torch.equal(fused, chained)
+    assert not torch.equal(fused, images)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from conftest import ROOT
+
+
+def grid(battlemap, grid_type, side, line_width, **options) -> np.ndarray:
+    image = torch.zeros((1, 160, 160, 3))
+    overlay = battlemap.BattlemapGrid().grid_overlay(
+        image, grid_type, side, line_width, 255, 255, 255, 255, **options)[0]
+    return battlemap.utils.tensor_to_uint8(overlay[0])[..., 0]
+
+
+@pytest.mark.parametrize("line_width", [1, 3])
+@pytest.mark.parametrize("grid_type", ["vertical hexagon",
+                                       "horizontal hexagon"])
+def test_hexagons_match_previous_releases(battlemap, grid_type, line_width):
+    # rendered before the edges were shared, when each was stroked twice:
+    # an anti-aliased pixel of coverage c was then 1 - (1 - c) ** 2
+    name = f"{grid_type.replace(' ', '_')}_{line_width}.png"
+    expected = np.asarray(Image.open(ROOT / "tests" / "data" / name)) / 255
+    coverage = grid(battlemap, grid_type, 24, line_width) / 255
+    outside = ((expected < coverage - 2 / 255)
+               | (expected > 1 - (1 - coverage) ** 2 + 2 / 255))
+    assert outside.mean() < 0.002
+
+
+@pytest.mark.parametrize("line_width", [1, 3])
+@pytest.mark.parametrize("grid_type", ["vertical hexagon",
+                                       "horizontal hexagon"])
+def test_sdf_hexagons_match_aggdraw(battlemap, grid_type, line_width):
+    aggdraw, sdf = (grid(battlemap, grid_type, 24, line_width,
+                         engine=engine).astype(int)
+                    for engine in ("aggdraw", "sdf"))
+    assert abs(aggdraw.mean() - sdf.mean()) < 1.2
+    assert np.abs(aggdraw - sdf).mean() < 1.2
+
+
+@pytest.mark.parametrize("line_width", [1, 3])
+def test_sdf_squares_match_aggdraw(battlemap, line_width):
+    aggdraw, sdf = (grid(battlemap, "square", 24, line_width,
+                         engine=engine).astype(int)
+                    for engine in ("aggdraw", "sdf"))
+    # but at the crossings, where aggdraw blends one stroke over the other,
+    # and on the center lines, which it strokes twice
+    lines = sdf > 0
+    crossings = (lines.mean(axis=1) > 0.5)[:, None] & (lines.mean(axis=0)
+                                                        > 0.5)[None]
+    center = np.abs(np.arange(160) + 0.5 - 80) < line_width / 2 + 1
+    skipped = crossings | center[:, None] | center[None]
+    assert np.abs(aggdraw - sdf)[~skipped].max() <= 1
+
+
+@pytest.mark.parametrize("engine", ["aggdraw", "sdf"])
+@pytest.mark.parametrize("grid_type", ["square", "vertical hexagon",
+                                       "horizontal hexagon"])
+def test_bands_match_the_whole_overlay(battlemap, grid_type, engine):
+    whole = grid(battlemap, grid_type, 24, 3, engine=engine).astype(int)
+    for band_height in (16, 100):
+        bands = grid(battlemap, grid_type, 24, 3, engine=engine,
+                     band_height=band_height)
+        # aggdraw rounds the slanted edges to float32, relative to the band
+        tolerance = 2 if engine == "aggdraw" and grid_type != "square" \
+            else 0
+        assert np.abs(bands - whole).max() <= tolerance
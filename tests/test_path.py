@@ -0,0 +1,50 @@
+import dataclasses
+
+import numpy as np
+
+
+def test_points_keep_the_list_api(battlemap):
+    Path, Point = battlemap.path.Path, battlemap.point.Point
+    path = Path(5, [Point(3, 4), Point(1, 2)])
+    path.add_point(Point(5, 6))
+    assert len(path.points) == 3 and len(path) == 3
+    assert path.points + [Point(7, 8)] == [Point(3, 4), Point(1, 2),
+                                          Point(5, 6), Point(7, 8)]
+    assert path.points.copy() == path.points
+    path.points.sort(key=lambda point: point.x)
+    assert path.coord() == [(1, 2), (3, 4), (5, 6)]
+    assert dataclasses.asdict(path) == {
+        "width": 5, "points": [{"x": 1, "y": 2}, {"x": 3, "y": 4},
+                               {"x": 5, "y": 6}]}
+    assert path == Path(5, [Point(1, 2), Point(3, 4), Point(5, 6)])
+
+
+def test_array_follows_the_points(battlemap):
+    Path, Point = battlemap.path.Path, battlemap.point.Point
+    path = Path(5, [Point(1, 2), Point(3, 4)])
+    assert path.array.dtype == np.int64
+    path.points[0].x = 100
+    assert path.array.tolist() == [[100, 2], [3, 4]]
+    points = path.points
+    path.array
+    del points[0]
+    assert path.array.tolist() == [[3, 4]]
+    path.points = [Point(0, 0)]
+    assert path.array.tolist() == [[0, 0]]
+
+
+def test_points_keep_their_type(battlemap):
+    Path, Point = battlemap.path.Path, battlemap.point.Point
+    path = Path(5, [Point(1, 2)])
+    path.add_point(Point(1.5, 2))
+    assert path.array.dtype == np.float64
+    assert type(path.points[0].x) is int
+    assert type(path.points[1].x) is float
+
+
+def test_from_array_keeps_the_dtype(battlemap):
+    Path = battlemap.path.Path
+    array = np.array([[1, 2], [3, 4]], dtype=np.float32)
+    path = Path.from_array(3, array)
+    assert path.array.dtype == np.float32
+    assert path.scaled(2).array.tolist() == [[2, 4], [6, 8]]
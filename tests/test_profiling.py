@@ -0,0 +1,32 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_stages_overlapping_threads_get_no_memory(battlemap):
+    profiling = battlemap.profiling
+
+    def work(index: int):
+        with profiling.stage("threaded"):
+            return bytearray(2 ** 20)
+
+    with profiling.profile("test") as profiler:
+        with profiling.stage("serial"):
+            profiling.count("items", 2)
+        with ThreadPoolExecutor(2) as executor:
+            with profiling.stage("overlapping"):
+                list(executor.map(profiling.in_context(work), range(4)))
+    report = json.loads(profiler.to_json())
+    assert report["counters"] == {"items": 2}
+    assert report["stages"]["threaded"]["calls"] == 4
+    assert report["stages"]["threaded"]["memory"] is None
+    assert report["stages"]["overlapping"]["memory"] is None
+    if profiling.resident_memory() is not None:
+        assert isinstance(report["stages"]["serial"]["memory"], int)
+
+
+def test_disabled_profile_records_nothing(battlemap):
+    profiling = battlemap.profiling
+    with profiling.profile("test", enabled=False) as profiler:
+        with profiling.stage("serial"):
+            profiling.count("items")
+    assert profiler is None
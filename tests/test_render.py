@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from conftest import ROOT
+
+SIZE = dict(grid_width=6, grid_height=5, grid_side=32, bg_color="#3A7D44")
+
+
+@pytest.mark.parametrize("tile_size", [64, 100])
+def test_tiled_map_matches_untiled(battlemap, tile_size):
+    node = battlemap.BattlemapMapGenerator()
+    whole = node.map_generator(3, **SIZE)[0]
+    tiled = node.map_generator(3, **SIZE, tile_size=tile_size)[0]
+    assert torch.equal(whole, tiled)
+
+
+@pytest.mark.parametrize("tile_size", [64, 100])
+def test_tiled_outdoors_matches_untiled(battlemap, tile_size):
+    node = battlemap.BattlemapMapGeneratorOutdoors()
+    features = dict(river=True, road=True, rocks=True, trees=True)
+    whole = node.map_generator(3, **SIZE, **features)[0]
+    tiled = node.map_generator(3, **SIZE, **features,
+                               tile_size=tile_size)[0]
+    assert torch.equal(whole, tiled)
+
+
+def test_legacy_background_matches_previous_releases(battlemap):
+    # rendered by the generator before the array based background
+    expected = np.asarray(Image.open(
+        ROOT / "tests" / "data" / "legacy_background.png"))
+    image = battlemap.BattlemapMapGenerator().map_generator(
+        7, 4, 3, 16, "#3A7D44", bg_mode="legacy")[0][0]
+    assert np.array_equal(battlemap.utils.tensor_to_uint8(image), expected)
+
+def test_toggling_a_feature_keeps_the_others(battlemap):
+    node = battlemap.BattlemapMapGeneratorOutdoors()
+    scenes = [node.map_generator(5, **SIZE, river=river, rocks=True,
+                                 trees=True)[-2]
+              for river in (False, True)]
+    for name in ("rocks", "trees"):
+        centers = [[feature["center"] for feature in scene["layers"][name]]
+                   for scene in scenes]
+        assert all(center in centers[0] for center in centers[1])
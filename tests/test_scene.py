@@ -0,0 +1,34 @@
+import json
+
+import pytest
+import torch
+
+FEATURES = dict(river=True, road=True, rocks=True, trees=True)
+
+
+@pytest.fixture
+def scene_dict(battlemap):
+    node = battlemap.BattlemapMapGeneratorOutdoors()
+    return node.map_generator(11, 6, 5, 32, "#3A7D44", **FEATURES)[-2]
+
+
+def test_scene_round_trips_through_json(battlemap, scene_dict):
+    Scene = battlemap.scene.Scene
+    data = json.loads(json.dumps(scene_dict))
+    scene = Scene.from_dict(data)
+    assert scene.to_dict() == scene_dict
+    assert set(scene.layers) == {"flowers", "rivers", "roads", "rocks",
+                                 "trees"}
+
+
+def test_restored_scene_renders_the_same_map(battlemap, scene_dict):
+    node = battlemap.BattlemapMapGeneratorOutdoors()
+    image = node.map_generator(11, 6, 5, 32, "#3A7D44", **FEATURES)[0]
+    rendered = battlemap.BattlemapSceneRenderer().scene_renderer(
+        json.loads(json.dumps(scene_dict)))[0]
+    assert torch.equal(image, rendered)
+
+
+def test_scene_of_another_version_is_refused(battlemap, scene_dict):
+    with pytest.raises(ValueError):
+        battlemap.scene.Scene.from_dict({**scene_dict, "version": 0})
@@ -1,23 +1,185 @@
+import tempfile
 import numpy as np
 import torch
 from PIL import Image
-from random import randint
+from random import randint, getrandbits
 from .point import Point
+from . import profiling
 
 
-def tensor_to_pil(image_tensor: torch.tensor) -> Image:
-    image_np = image_tensor.cpu().numpy()
-    image_pil = Image.fromarray((image_np.squeeze(0) * 255).astype(np.uint8))
-    return image_pil.convert("RGBA")
+def tensor_to_pil(image_tensor: torch.Tensor,
+                  buffer: np.ndarray = None) -> Image:
+    """
+    Convert one frame (H, W, C) or a batch of one (1, H, W, C) to a PIL
+    image. The uint8 conversion goes through `buffer` when one is given so
+    that a batch can reuse the same staging memory for every frame.
+    """
+    if image_tensor.dim() == 4:
+        if image_tensor.shape[0] != 1:
+            raise ValueError("Convert the frames of a batch one at a time")
+        image_tensor = image_tensor[0]
+    image_np = image_tensor.detach().cpu().numpy()
+    if buffer is None:
+        buffer = np.empty(image_np.shape, dtype=np.uint8)
+    np.multiply(image_np, 255, out=buffer, casting="unsafe")
+    return Image.fromarray(buffer, "RGBA" if buffer.shape[2] == 4 else "RGB")
 
 
-def pil_to_tensor(image_pil: Image) -> torch.Tensor:
-    image_tensor_out = torch.tensor(
-        np.array(image_pil).astype(np.float32) / 255.0)
-    return torch.unsqueeze(image_tensor_out, 0)
+def pil_to_tensor(image_pil: Image, out: torch.Tensor = None,
+                  buffer: np.ndarray = None) -> torch.Tensor:
+    """
+    Convert a PIL image to a 3 channel IMAGE. The result is written into
+    `out` (H, W, 3) when given, otherwise a batch of one is returned.
+    """
+    if image_pil.mode not in ("RGB", "RGBA"):
+        image_pil = image_pil.convert("RGB")
+    shape = (image_pil.height, image_pil.width, len(image_pil.mode))
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, dtype=np.uint8)
+    np.copyto(buffer, np.asarray(image_pil))
+    image_tensor_out = out if out is not None else torch.empty(
+        (*shape[:2], 3), dtype=torch.float32)
+    image_tensor_out.copy_(torch.from_numpy(buffer[..., :3])).div_(255.0)
+    if out is None:
+        return torch.unsqueeze(image_tensor_out, 0)
+    return image_tensor_out
 
 
-def generate_noise(image, point1: Point, point2: Point, padding=0):
+def tensor_to_uint8(image_tensor: torch.Tensor, out: np.ndarray = None,
+                    band_height: int = 256) -> np.ndarray:
+    """
+    Exact inverse of pil_to_tensor for one (H, W, C) frame, converted by
+    bands of rows to bound the temporary memory.
+    """
+    if out is None:
+        out = np.empty(image_tensor.shape, dtype=np.uint8)
+    for y in range(0, image_tensor.shape[0], band_height):
+        band = image_tensor[y:y + band_height].detach().cpu().numpy()
+        np.rint(band * 255, out=out[y:y + band_height], casting="unsafe")
+    return out
+
+
+def patch_images(images: torch.Tensor, box: tuple, func,
+                 inplace: bool = False) -> torch.Tensor:
+    """
+    Apply func(patch, origin) to the box (left, top, right, bottom) of
+    every frame of an IMAGE batch, only converting that region to a PIL
+    image. The result is written back into a 3 channel copy of images, or
+    into images itself when inplace is set.
+    """
+    images_out = images if inplace else images[..., :3].clone()
+    height, width = images.shape[1:3]
+    left, top = max(0, int(box[0])), max(0, int(box[1]))
+    right, bottom = min(width, int(box[2])), min(height, int(box[3]))
+    if left >= right or top >= bottom:
+        return images_out
+    region = images_out[:, top:bottom, left:right, :3]
+    buffer = np.empty((bottom - top, right - left, 3), dtype=np.uint8)
+    for i in range(region.shape[0]):
+        patch = func(tensor_to_pil(region[i], buffer), Point(left, top))
+        pil_to_tensor(patch, region[i], buffer)
+    return images_out
+
+
+def numpy_rng(rng: np.random.Generator = None) -> np.random.Generator:
+    """
+    Return rng, or a generator seeded from the global random state so that
+    callers relying on random.seed() stay reproducible.
+    """
+    if rng is not None:
+        return rng
+    return np.random.default_rng(getrandbits(64))
+
+
+def clip_box(image, point1: Point, point2: Point, padding=0) -> tuple:
+    left = max(0, point1.x - padding)
+    top = max(0, point1.y - padding)
+    right = min(image.width, point2.x + padding)
+    bottom = min(image.height, point2.y + padding)
+    return int(left), int(top), int(right), int(bottom)
+
+
+def generate_noise(image, point1: Point, point2: Point, padding=0,
+                   rng: np.random.Generator = None, amplitude: int = 64,
+                   band_height: int = 512):
+    left, top, right, bottom = clip_box(image, point1, point2, padding)
+    if left >= right or top >= bottom:
+        return
+    rng = numpy_rng(rng)
+    profiling.count("noise_pixels", (right - left) * (bottom - top))
+    with profiling.stage("noise"):
+        for y in range(top, bottom, band_height):
+            box = (left, y, right, min(y + band_height, bottom))
+            region = np.array(image.crop(box), dtype=np.int16)
+            region[..., :3] += rng.integers(-amplitude, amplitude + 1,
+                                            size=region[..., :3].shape,
+                                            dtype=np.int16)
+            np.clip(region, 0, 255, out=region)
+            image.paste(Image.fromarray(region.astype(np.uint8), image.mode),
+                        box[:2])
+
+
+def block_integers(entropy: tuple, box: tuple, low: int, high: int,
+                   channels: int = 3, block: int = 64) -> np.ndarray:
+    """
+    Random integers in [low, high] for every pixel of a box of the plane.
+    Values are drawn by fixed blocks, each from a generator seeded with the
+    entropy and the block position, so they do not depend on how the plane
+    is split into tiles.
+    """
+    left, top, right, bottom = box
+    values = np.empty((bottom - top, right - left, channels), dtype=np.int16)
+    for block_y in range(top // block, (bottom - 1) // block + 1):
+        for block_x in range(left // block, (right - 1) // block + 1):
+            rng = np.random.default_rng((*entropy, block_y, block_x))
+            block_values = rng.integers(low, high + 1, dtype=np.int16,
+                                        size=(block, block, channels))
+            y0, x0 = block_y * block, block_x * block
+            y1, x1 = max(top, y0), max(left, x0)
+            y2, x2 = min(bottom, y0 + block), min(right, x0 + block)
+            values[y1 - top:y2 - top, x1 - left:x2 - left] = \
+                block_values[y1 - y0:y2 - y0, x1 - x0:x2 - x0]
+    return values
+
+
+def generate_block_noise(image, origin: Point, box: tuple, entropy: tuple,
+                         amplitude: int = 64):
+    """
+    Tile independent version of generate_noise: `image` covers the plane
+    from `origin` and `box` is given in plane coordinates.
+    """
+    left, top = max(box[0], origin.x), max(box[1], origin.y)
+    right = min(box[2], origin.x + image.width)
+    bottom = min(box[3], origin.y + image.height)
+    if left >= right or top >= bottom:
+        return
+    crop = (left - origin.x, top - origin.y,
+            right - origin.x, bottom - origin.y)
+    profiling.count("noise_pixels", (right - left) * (bottom - top))
+    with profiling.stage("noise"):
+        region = np.array(image.crop(crop), dtype=np.int16)
+        region[..., :3] += block_integers(entropy, (left, top, right, bottom),
+                                          -amplitude, amplitude)
+        np.clip(region, 0, 255, out=region)
+        image.paste(Image.fromarray(region.astype(np.uint8), image.mode),
+                    crop[:2])
+
+
+def empty_image(batch: int, height: int, width: int,
+                memmap: bool = False) -> torch.Tensor:
+    """
+    Allocate a 3 channel IMAGE, backed by an anonymous temporary file when
+    memmap is set so that the operating system can page it out.
+    """
+    shape = (batch, height, width, 3)
+    if not memmap:
+        return torch.empty(shape, dtype=torch.float32)
+    with tempfile.TemporaryFile(prefix="battlemap-") as file:
+        array = np.memmap(file, dtype=np.float32, mode="w+", shape=shape)
+    return torch.from_numpy(array)
+
+
+def generate_noise_legacy(image, point1: Point, point2: Point, padding=0):
     def noise_color(i: int, j: int, color_index: int) -> int:
         noise = randint(-64, 64)
         return max(0, min(pixels[i, j][color_index] + noise, 255))